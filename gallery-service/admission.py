@@ -0,0 +1,102 @@
+"""Memory-budgeted admission control for image work
+
+Decoding a full-resolution photo costs width x height x bands bytes before
+any resizing happens, so a burst of large uploads can push a 512MB VM into
+the OOM killer. MemoryBudget caps the estimated decode memory that may be in
+use at once; work that can't get a reservation in time is turned away with a
+Retry-After instead of crashing the service.
+"""
+
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Optional, Union
+
+from PIL import Image
+
+from imaging import draft_scale
+
+
+class MemoryBudgetExceeded(Exception):
+    """Raised when image work can't be admitted within the wait timeout"""
+
+    def __init__(self, retry_after: int):
+        super().__init__('Server is busy processing other photos, try again shortly')
+        self.retry_after = retry_after
+
+
+def estimate_image_memory(source: Union[Path, BinaryIO], max_width: int) -> int:
+    """Estimate peak bytes to decode and resize an image, from its header only
+
+    Counts the decoded image (at the reduced JPEG scale load_resized will
+    use), an RGB copy if the mode needs converting, and the resized output.
+    Streams are rewound to where they started.
+    """
+    position = None if isinstance(source, Path) else source.tell()
+    try:
+        with Image.open(source) as img:
+            width, height = img.size
+            bands = len(img.getbands())
+            mode = img.mode
+            scale = draft_scale(img.size, max_width) if img.format == 'JPEG' else 1
+    finally:
+        if position is not None:
+            source.seek(position)
+
+    decoded_pixels = -(-width // scale) * -(-height // scale)
+    decoded = decoded_pixels * bands
+    if mode in ('RGBA', 'P'):
+        decoded += decoded_pixels * 3
+    if width > max_width:
+        decoded += max_width * int(height * max_width / width) * 3
+    return decoded
+
+
+class MemoryBudget:
+    """Counting semaphore over bytes of estimated image memory"""
+
+    def __init__(self, limit_bytes: int, retry_after: int = 10):
+        self.limit_bytes = limit_bytes
+        self.retry_after = retry_after
+        self.in_use = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def saturated(self) -> bool:
+        """True when new work would have to queue behind existing work"""
+        with self._cond:
+            return self.waiting > 0 or self.in_use >= self.limit_bytes
+
+    def acquire(self, nbytes: int, timeout: Optional[float] = None) -> int:
+        """Reserve nbytes, waiting up to timeout seconds (None waits forever)
+
+        An image bigger than the whole budget is clamped to it, so it runs
+        alone rather than never. Returns the amount actually reserved.
+        """
+        nbytes = min(nbytes, self.limit_bytes)
+        with self._cond:
+            self.waiting += 1
+            try:
+                admitted = self._cond.wait_for(
+                    lambda: self.in_use + nbytes <= self.limit_bytes,
+                    timeout
+                )
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                raise MemoryBudgetExceeded(self.retry_after)
+            self.in_use += nbytes
+        return nbytes
+
+    def release(self, nbytes: int) -> None:
+        with self._cond:
+            self.in_use -= nbytes
+            self._cond.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes: int, timeout: Optional[float] = None):
+        reserved = self.acquire(nbytes, timeout)
+        try:
+            yield reserved
+        finally:
+            self.release(reserved)
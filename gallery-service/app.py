@@ -6,16 +6,38 @@ creates gallery markdown, and commits to GitHub.
 """
 
 import os
+import shutil
 import tempfile
+import time
 from datetime import datetime
 from pathlib import Path
 
-from flask import Flask, request, jsonify
+from botocore.exceptions import ClientError
+from flask import Flask, Request, Response, g, request, jsonify
 from werkzeug.utils import secure_filename
 
-from gallery_processor import GalleryProcessor
+import metrics
+from admission import MemoryBudget, MemoryBudgetExceeded
+from disk_cache import DiskLRUCache
+from gallery_processor import VARIANT_FORMATS, GalleryProcessor
+from jobs import GalleryJobs
+
+UPLOAD_SPILL_BYTES = int(os.getenv('UPLOAD_SPILL_BYTES', str(8 * 1024 * 1024)))
+
+
+class SpooledUploadRequest(Request):
+    """Keeps uploaded files in memory unless one exceeds UPLOAD_SPILL_BYTES
+
+    Werkzeug's default writes any upload in a body over 500KB to a temp file,
+    which for a gallery means every photo goes through the disk.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPILL_BYTES)
+
 
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max (pre-resized images)
 
 # Configuration from environment
@@ -24,14 +46,143 @@ AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
 S3_MEDIA_BUCKET = os.getenv('S3_MEDIA_BUCKET', 'i.clintecker.com')
 GALLERY_API_KEY = os.getenv('GALLERY_API_KEY')
+S3_UPLOAD_CONCURRENCY = int(os.getenv('S3_UPLOAD_CONCURRENCY', '8'))
+# Image worker processes: 'auto' sizes from cores and memory, 0 = in-process
+IMAGE_WORKERS = os.getenv('IMAGE_WORKERS', 'auto')
+# Estimated decode memory allowed at once across all requests (0 = unlimited),
+# how long a synchronous request may wait for it, and the Retry-After we send
+IMAGE_MEMORY_BUDGET_MB = int(os.getenv('IMAGE_MEMORY_BUDGET_MB', '192'))
+ADMISSION_WAIT_SECONDS = float(os.getenv('ADMISSION_WAIT_SECONDS', '15'))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', '30'))
+# SQS queue notified of each new manifest for the push-driven consumer
+GALLERY_QUEUE_URL = os.getenv('GALLERY_QUEUE_URL')
+GALLERY_JOB_WORKERS = int(os.getenv('GALLERY_JOB_WORKERS', '2'))
+GALLERY_JOB_SPOOL_DIR = os.getenv(
+    'GALLERY_JOB_SPOOL_DIR',
+    os.path.join(tempfile.gettempdir(), 'gallery-jobs')
+)
+# On-demand variants (/img/<key>): where they are cached and how much disk
+# they may use, the widths that may be requested, and the only key prefix
+# originals are served from
+IMAGE_CACHE_DIR = os.getenv(
+    'IMAGE_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'gallery-image-cache')
+)
+IMAGE_CACHE_MAX_MB = int(os.getenv('IMAGE_CACHE_MAX_MB', '512'))
+IMAGE_WIDTHS = frozenset(
+    int(w) for w in os.getenv('IMAGE_WIDTHS', '320,768,1200,1600').split(',') if w.strip()
+)
+IMAGE_ORIGIN_PREFIX = os.getenv('IMAGE_ORIGIN_PREFIX', 'galleries/')
+
+if GALLERY_QUEUE_URL:
+    PUBLISH_NOTE = 'Gallery will be live shortly, once the site rebuild finishes'
+else:
+    PUBLISH_NOTE = 'Gallery will be live within 20 minutes, after the next scheduled GitHub Actions run'
+
+memory_budget = None
+if IMAGE_MEMORY_BUDGET_MB > 0:
+    memory_budget = MemoryBudget(
+        IMAGE_MEMORY_BUDGET_MB * 1024 * 1024,
+        retry_after=ADMISSION_RETRY_AFTER
+    )
 
 processor = GalleryProcessor(
     aws_access_key=AWS_ACCESS_KEY_ID,
     aws_secret_key=AWS_SECRET_ACCESS_KEY,
     aws_region=AWS_REGION,
-    s3_bucket=S3_MEDIA_BUCKET
+    s3_bucket=S3_MEDIA_BUCKET,
+    upload_concurrency=S3_UPLOAD_CONCURRENCY,
+    image_workers=None if IMAGE_WORKERS == 'auto' else int(IMAGE_WORKERS),
+    memory_budget=memory_budget,
+    queue_url=GALLERY_QUEUE_URL
 )
 
+image_cache = DiskLRUCache(Path(IMAGE_CACHE_DIR), IMAGE_CACHE_MAX_MB * 1024 * 1024)
+
+jobs = GalleryJobs(
+    processor,
+    spool_dir=Path(GALLERY_JOB_SPOOL_DIR),
+    workers=GALLERY_JOB_WORKERS
+)
+
+
+def is_authorized() -> bool:
+    """Check the X-API-Key header against the configured key"""
+    api_key = request.headers.get('X-API-Key')
+    return bool(api_key) and api_key == GALLERY_API_KEY
+
+
+def wants_async() -> bool:
+    """Async mode is requested with ?async=1 or an 'async' form field"""
+    value = request.args.get('async') or request.form.get('async') or ''
+    return value.strip().lower() in ('1', 'true', 'yes')
+
+
+def busy_response(retry_after: int):
+    """503 telling the client when to retry"""
+    response = jsonify({'error': 'Server is busy processing other photos, try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def save_photos(photos, dest_dir: Path):
+    """Save uploaded files into dest_dir, in order, and return their paths
+
+    Files are named by position, keeping only the client's extension:
+    uploads often share a name (every iOS share is image.jpg).
+    """
+    photo_paths = []
+    for photo in photos:
+        if photo.filename:
+            suffix = Path(secure_filename(photo.filename)).suffix
+            filepath = dest_dir / f'photo-{len(photo_paths):02d}{suffix}'
+            photo.save(filepath)
+            photo_paths.append(filepath)
+    return photo_paths
+
+
+def preferred_format() -> str:
+    """Best variant format the client says it accepts"""
+    accept = request.headers.get('Accept', '')
+    for fmt, content_type in (('avif', 'image/avif'), ('webp', 'image/webp')):
+        # Only explicit support counts; browsers send */* for everything
+        if content_type in accept:
+            return fmt
+    return 'jpg'
+
+
+@app.before_request
+def start_request_timing():
+    g.timings = metrics.RequestTimings()
+    g.timings_token = metrics.current_request.set(g.timings)
+
+
+@app.after_request
+def finish_request_timing(response):
+    timings = g.pop('timings', None)
+    if timings is not None:
+        response.headers['Server-Timing'] = timings.server_timing()
+        metrics.request_seconds.observe(
+            time.perf_counter() - timings.started,
+            request.url_rule.rule if request.url_rule else 'unmatched',
+            str(response.status_code)
+        )
+    return response
+
+
+@app.teardown_request
+def reset_request_timing(exc=None):
+    token = g.pop('timings_token', None)
+    if token is not None:
+        metrics.current_request.reset(token)
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Prometheus metrics"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 
 @app.route('/health', methods=['GET'])
 def health():
@@ -39,6 +190,61 @@ def health():
     return jsonify({'status': 'ok', 'service': 'gallery-service'})
 
 
+@app.route('/img/<path:key>', methods=['GET'])
+def image_variant(key):
+    """Serve a resized variant of an original in the media bucket
+
+    Query parameters:
+    - w: output width, one of IMAGE_WIDTHS (narrower originals are not upscaled)
+    - fmt: jpg, webp or avif; without it, the best format the Accept header allows
+
+    Variants are rendered on first request and kept in the disk cache;
+    concurrent requests for the same uncached variant share one render.
+    """
+    width = request.args.get('w', type=int)
+    if width not in IMAGE_WIDTHS:
+        allowed = ', '.join(str(w) for w in sorted(IMAGE_WIDTHS))
+        return jsonify({'error': f'w must be one of {allowed}'}), 400
+
+    negotiated = 'fmt' not in request.args
+    fmt = preferred_format() if negotiated else request.args['fmt']
+    if fmt not in VARIANT_FORMATS:
+        return jsonify({'error': f"fmt must be one of {', '.join(VARIANT_FORMATS)}"}), 400
+
+    if not key.startswith(IMAGE_ORIGIN_PREFIX) or '..' in key.split('/'):
+        return jsonify({'error': 'Not found'}), 404
+
+    def render() -> bytes:
+        # Originals are downloaded whole before the render can reserve
+        # memory for them, so don't start a download that would only queue
+        if memory_budget is not None and memory_budget.saturated():
+            raise MemoryBudgetExceeded(memory_budget.retry_after)
+        original = processor.fetch_original(key)
+        return processor.render_variant(original, width, fmt, ADMISSION_WAIT_SECONDS)
+
+    try:
+        data, outcome = image_cache.get_or_create(f'{key}?w={width}&fmt={fmt}', render)
+    except ClientError as e:
+        if e.response['Error']['Code'] in ('NoSuchKey', '404'):
+            return jsonify({'error': 'Not found'}), 404
+        app.logger.error(f"Error fetching {key}: {e}")
+        return jsonify({'error': 'Could not fetch original'}), 502
+    except MemoryBudgetExceeded as e:
+        return busy_response(e.retry_after)
+    except Exception as e:
+        app.logger.error(f"Error rendering {key} at {width}w {fmt}: {e}", exc_info=True)
+        return jsonify({'error': 'Could not render image'}), 500
+
+    metrics.image_cache_requests.inc(1, outcome)
+    response = Response(data, mimetype=VARIANT_FORMATS[fmt][1])
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    response.headers['X-Cache'] = outcome
+    if negotiated:
+        response.vary.add('Accept')
+    response.add_etag()
+    return response.make_conditional(request)
+
+
 @app.route('/gallery', methods=['POST'])
 def create_gallery():
     """Create a new gallery from uploaded photos
@@ -49,11 +255,12 @@ def create_gallery():
     - description: Optional description
     - tags: Optional comma-separated tags
     - photos: Multiple file uploads
+    - async: Optional; when truthy (query or form), respond 202 with a job id
+      and process the gallery in the background
     """
     try:
         # Validate API key
-        api_key = request.headers.get('X-API-Key')
-        if not api_key or api_key != GALLERY_API_KEY:
+        if not is_authorized():
             return jsonify({'error': 'Unauthorized'}), 401
 
         # Validate request
@@ -77,47 +284,95 @@ def create_gallery():
         if len(photos) > 50:
             return jsonify({'error': f'Too many photos. Maximum 50, got {len(photos)}'}), 400
 
-        # Create temp directory for processing
-        with tempfile.TemporaryDirectory() as temp_dir:
-            temp_path = Path(temp_dir)
-
-            # Save uploaded files
-            photo_paths = []
-            for photo in photos:
-                if photo.filename:
-                    filename = secure_filename(photo.filename)
-                    filepath = temp_path / filename
-                    photo.save(filepath)
-                    photo_paths.append(filepath)
-
-            if not photo_paths:
-                return jsonify({'error': 'No valid photos uploaded'}), 400
-
-            # Process gallery (uploads photos + metadata to S3)
-            gallery_data = processor.process_gallery(
-                photos=photo_paths,
-                title=title,
-                description=description,
-                tags=tags
-            )
-
-            return jsonify({
-                'success': True,
-                'gallery': {
-                    'title': gallery_data['title'],
-                    'slug': gallery_data['slug'],
-                    'photo_count': len(gallery_data['photos']),
-                    'url': f"https://clintecker.com/galleries/{gallery_data['slug']}/",
-                    'pending': True,
-                    'note': 'Gallery will be live in 2-3 minutes after GitHub Actions processes it'
-                }
-            })
+        if wants_async():
+            return submit_gallery_job(photos, title, description, tags)
+
+        # Synchronous requests can't wait long for memory; turn them away
+        # early if other galleries are already queued for it
+        if memory_budget is not None and memory_budget.saturated():
+            return busy_response(memory_budget.retry_after)
+
+        # Stream uploads straight from the request; nothing is written to disk
+        valid_photos = []
+        for photo in photos:
+            if photo.filename:
+                photo.filename = secure_filename(photo.filename)
+                valid_photos.append(photo)
+
+        if not valid_photos:
+            return jsonify({'error': 'No valid photos uploaded'}), 400
 
+        # Process gallery (uploads photos + metadata to S3)
+        gallery_data = processor.process_gallery(
+            photos=valid_photos,
+            title=title,
+            description=description,
+            tags=tags,
+            admission_timeout=ADMISSION_WAIT_SECONDS
+        )
+
+        return jsonify({
+            'success': True,
+            'gallery': {
+                'title': gallery_data['title'],
+                'slug': gallery_data['slug'],
+                'photo_count': len(gallery_data['photos']),
+                'url': f"https://clintecker.com/galleries/{gallery_data['slug']}/",
+                'pending': True,
+                'note': PUBLISH_NOTE
+            }
+        })
+
+    except MemoryBudgetExceeded as e:
+        app.logger.warning(f"Rejected gallery, memory budget exhausted: {e}")
+        return busy_response(e.retry_after)
     except Exception as e:
         app.logger.error(f"Error creating gallery: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
 
 
+def submit_gallery_job(photos, title: str, description: str, tags):
+    """Spool uploads to disk and hand them to the background job pool"""
+    job_id, job_dir = jobs.create_job_dir()
+    with metrics.stage('spool'):
+        photo_paths = save_photos(photos, job_dir)
+
+    if not photo_paths:
+        shutil.rmtree(job_dir, ignore_errors=True)
+        return jsonify({'error': 'No valid photos uploaded'}), 400
+
+    job = jobs.submit(
+        job_id,
+        photo_paths=photo_paths,
+        title=title,
+        description=description,
+        tags=tags
+    )
+
+    status_url = f"/gallery/jobs/{job_id}"
+    response = jsonify({
+        'success': True,
+        'job': job,
+        'status_url': status_url
+    })
+    response.status_code = 202
+    response.headers['Location'] = status_url
+    return response
+
+
+@app.route('/gallery/jobs/<job_id>', methods=['GET'])
+def gallery_job_status(job_id):
+    """Report progress of a gallery submitted with async=1"""
+    if not is_authorized():
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    return jsonify({'job': job})
+
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 8080))
     app.run(host='0.0.0.0', port=port, debug=os.getenv('DEBUG', 'false').lower() == 'true')
@@ -0,0 +1,130 @@
+"""Size-bounded LRU cache of rendered images on local disk
+
+Entries are files named by the SHA-256 of their key. Recency lives in
+memory and is rebuilt from file access times on startup, so a restart keeps
+a warm cache. Once the total passes max_bytes, least recently used files
+are deleted.
+
+get_or_create coalesces concurrent misses: the first caller renders and
+everyone else asking for the same key waits for its result, so a burst of
+requests for a new variant costs one S3 fetch and one encode.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+
+
+class DiskLRUCache:
+    """Thread-safe LRU of byte strings, bounded by total file size"""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        # file name -> size, least recently used first
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        self._inflight: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> None:
+        files = []
+        for path in self.directory.iterdir():
+            if path.name.startswith('.'):
+                # Leftover temp file from an interrupted write
+                path.unlink(missing_ok=True)
+                continue
+            stat = path.stat()
+            files.append((stat.st_atime, path.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self.total_bytes += size
+        with self._lock:
+            self._evict()
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Cached bytes for key, or None"""
+        name = self._name(key)
+        with self._lock:
+            if name not in self._entries:
+                return None
+            self._entries.move_to_end(name)
+        try:
+            return (self.directory / name).read_bytes()
+        except FileNotFoundError:
+            # Evicted between the lookup and the read
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store data under key, evicting old entries past max_bytes"""
+        if len(data) > self.max_bytes:
+            return
+        name = self._name(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, self.directory / name)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        with self._lock:
+            self.total_bytes += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self.total_bytes > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            (self.directory / name).unlink(missing_ok=True)
+
+    def get_or_create(self, key: str, create: Callable[[], bytes]) -> Tuple[bytes, str]:
+        """Cached bytes for key, calling create() on a miss
+
+        Returns (data, outcome) where outcome is 'hit', 'miss' (this call
+        created it) or 'coalesced' (waited for another call's create). If
+        create raises, every waiting caller gets the exception and nothing
+        is cached.
+        """
+        data = self.get(key)
+        if data is not None:
+            return data, 'hit'
+
+        with self._lock:
+            future = self._inflight.get(key)
+            # A create that finished since the lookup above has cached it
+            cached = future is None and self._name(key) in self._entries
+            owner = future is None and not cached
+            if owner:
+                future = self._inflight[key] = Future()
+        if cached:
+            data = self.get(key)
+            if data is not None:
+                return data, 'hit'
+            return self.get_or_create(key, create)
+        if not owner:
+            return future.result(), 'coalesced'
+
+        try:
+            data = create()
+            self.put(key, data)
+            future.set_result(data)
+            return data, 'miss'
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
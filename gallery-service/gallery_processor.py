@@ -1,73 +1,417 @@
 """Gallery photo processing and S3 upload"""
 
+import contextvars
+import io
 import json
+import logging
+import multiprocessing
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple, Union
 from urllib.parse import quote
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
 from PIL import Image
 from slugify import slugify
 
+import metrics
+from admission import MemoryBudget, estimate_image_memory
+from imaging import load_resized
+
+logger = logging.getLogger(__name__)
+
+# A photo is either a file on disk or an upload exposing .filename and .stream
+# (werkzeug's FileStorage)
+PhotoSource = Any
+
+# Rough peak RSS of one worker optimizing a 12MP photo (decoded RGB plus the
+# resize buffer and encoder state), and memory kept back for the web process
+IMAGE_WORKER_MEMORY_MB = 160
+RESERVED_MEMORY_MB = 256
+
+# On-demand variant formats: name -> (Pillow format, content type, quality,
+# modes converted to RGB first); qualities match tools/process_photos.py
+VARIANT_FORMATS = {
+    'jpg': ('JPEG', 'image/jpeg', 85, ('RGBA', 'LA', 'P')),
+    'webp': ('WEBP', 'image/webp', 80, ('P', 'CMYK')),
+    'avif': ('AVIF', 'image/avif', 80, ('P', 'CMYK')),
+}
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on (respects container CPU pinning)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def available_memory_mb() -> int:
+    """Memory limit of the container, falling back to physical memory"""
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            value = Path(path).read_text().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:
+            return int(value) // (1024 * 1024)
+    return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // (1024 * 1024)
+
+
+def default_image_workers() -> int:
+    """Size the image worker pool from cores and memory
+
+    Returns 0 (optimize in-process) when the machine can't usefully run at
+    least two workers, e.g. a 512MB shared-CPU VM.
+    """
+    by_memory = (available_memory_mb() - RESERVED_MEMORY_MB) // IMAGE_WORKER_MEMORY_MB
+    workers = min(available_cpus(), by_memory)
+    return workers if workers >= 2 else 0
+
+
+def optimize_bytes(data: bytes, max_width: int = 1600) -> bytes:
+    """Optimize an encoded image and return the JPEG bytes
+
+    Runs in image worker processes, so it takes and returns compressed bytes:
+    a few hundred KB crosses the process boundary instead of decoded pixels.
+    """
+    output = io.BytesIO()
+    optimize_into(io.BytesIO(data), output, max_width)
+    return output.getvalue()
+
+
+def optimize_into(
+    input_path: Union[Path, BinaryIO],
+    output_path: Union[Path, BinaryIO],
+    max_width: int = 1600
+) -> None:
+    """Resize (if wider than max_width) and re-encode as optimized JPEG"""
+    # Decode at reduced scale when the photo is too large (safety check),
+    # converting to RGB if necessary
+    img = load_resized(input_path, max_width, rgb_modes=('RGBA', 'P'))
+
+    # Save with optimization (lightweight compression)
+    img.save(output_path, 'JPEG', quality=90, optimize=True)
+
+
+def render_variant_bytes(data: bytes, width: int, fmt: str) -> bytes:
+    """Resize an encoded image to width and encode it as fmt (see VARIANT_FORMATS)
+
+    Like optimize_bytes, takes and returns compressed bytes so it can run in
+    an image worker process.
+    """
+    pil_format, _, quality, rgb_modes = VARIANT_FORMATS[fmt]
+    img = load_resized(io.BytesIO(data), width, rgb_modes=rgb_modes)
+    output = io.BytesIO()
+    save_args = {'optimize': True} if pil_format == 'JPEG' else {}
+    img.save(output, pil_format, quality=quality, **save_args)
+    return output.getvalue()
+
 
 class GalleryProcessor:
     """Processes photos for gallery: optimizes and uploads to S3"""
 
-    def __init__(self, aws_access_key: str, aws_secret_key: str, aws_region: str, s3_bucket: str):
+    def __init__(
+        self,
+        aws_access_key: str,
+        aws_secret_key: str,
+        aws_region: str,
+        s3_bucket: str,
+        upload_concurrency: int = 8,
+        image_workers: Optional[int] = None,
+        memory_budget: Optional[MemoryBudget] = None,
+        queue_url: Optional[str] = None
+    ):
+        """image_workers: size of the image process pool; None sizes it from
+        the machine, 0 optimizes on the calling thread
+
+        memory_budget: if given, every decode first reserves its estimated
+        memory from it (shared by all galleries in this process)
+
+        queue_url: if given, an SQS queue told about each new manifest so a
+        watching consumer can publish it right away"""
         self.s3_bucket = s3_bucket
+        # One client for every upload thread; its connection pool is sized so
+        # concurrent uploads (and their multipart parts) never wait on a socket
         self.s3_client = boto3.client(
             's3',
             aws_access_key_id=aws_access_key,
             aws_secret_access_key=aws_secret_key,
-            region_name=aws_region
+            region_name=aws_region,
+            config=Config(
+                max_pool_connections=upload_concurrency * 2,
+                retries={'max_attempts': 5, 'mode': 'adaptive'}
+            )
+        )
+        # Counts every S3 call and the retries botocore needed for it
+        self.s3_client.meta.events.register('after-call.s3', metrics.record_s3_call)
+        # Gallery photos are a few hundred KB, so nearly everything goes up as
+        # a single PUT; only unusually large originals are split into parts
+        self.transfer_config = TransferConfig(
+            multipart_threshold=16 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=2
+        )
+        # Shared across galleries so total S3 concurrency stays bounded even
+        # when several background jobs run at once
+        self.upload_executor = ThreadPoolExecutor(
+            max_workers=upload_concurrency,
+            thread_name_prefix='s3-upload'
         )
+        # Caps queued-but-unfinished uploads so optimization can't run far
+        # ahead of the network
+        self.upload_slots = threading.BoundedSemaphore(upload_concurrency * 2)
 
-    def optimize_image(self, input_path: Path, output_path: Path, max_width: int = 1600) -> None:
+        if image_workers is None:
+            image_workers = default_image_workers()
+        self.image_workers = image_workers
+        self.memory_budget = memory_budget
+        self._pool_lock = threading.Lock()
+        self.image_pool = self._new_image_pool() if image_workers > 0 else None
+
+        self.queue_url = queue_url
+        self.sqs_client = None
+        if queue_url:
+            self.sqs_client = boto3.client(
+                'sqs',
+                aws_access_key_id=aws_access_key,
+                aws_secret_access_key=aws_secret_key,
+                region_name=aws_region
+            )
+
+    def _new_image_pool(self) -> ProcessPoolExecutor:
+        # forkserver: forking a process that already runs upload threads is unsafe
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        return ProcessPoolExecutor(
+            max_workers=self.image_workers,
+            mp_context=context,
+            # Recycle workers now and then so Pillow heap fragmentation can't accumulate
+            max_tasks_per_child=100
+        )
+
+    def optimize_image(
+        self,
+        input_path: Union[Path, BinaryIO],
+        output_path: Union[Path, BinaryIO],
+        max_width: int = 1600
+    ) -> None:
         """Optimize image: resize and compress if needed
 
+        Input and output may be paths or binary file objects.
+
         Note: iOS Shortcut should pre-resize to 1200px, so this is mostly a safety check
         """
-        with Image.open(input_path) as img:
-            # Convert to RGB if necessary
-            if img.mode in ('RGBA', 'P'):
-                img = img.convert('RGB')
-
-            # Only resize if photo is still too large (safety check)
-            if img.width > max_width:
-                ratio = max_width / img.width
-                new_height = int(img.height * ratio)
-                img = img.resize((max_width, new_height), Image.Resampling.LANCZOS)
-
-            # Save with optimization (lightweight compression)
-            img.save(output_path, 'JPEG', quality=90, optimize=True)
-
-    def upload_to_s3(self, file_path: Path, s3_key: str, content_type: str = 'image/jpeg') -> str:
-        """Upload file to S3 and return public URL"""
-        self.s3_client.upload_file(
-            str(file_path),
-            self.s3_bucket,
-            s3_key,
-            ExtraArgs={
-                'ContentType': content_type,
-                'CacheControl': 'public, max-age=31536000',
-            }
-        )
+        optimize_into(input_path, output_path, max_width)
+
+    def submit_optimize(
+        self,
+        source: Union[Path, BinaryIO],
+        max_width: int = 1600,
+        admission_timeout: Optional[float] = None
+    ) -> Tuple[Future, bytes]:
+        """Start optimizing a photo; returns (future of JPEG bytes, input bytes)
+
+        With no image pool the work happens right here and the returned
+        future is already done. The input bytes are kept so a photo can be
+        retried in-process if the pool dies.
+
+        With a memory budget, waits up to admission_timeout seconds for the
+        decode to be admitted and raises MemoryBudgetExceeded otherwise.
+        """
+        if self.image_pool is None:
+            self._record_source(source)
+            reserved = self._reserve_memory(source, max_width, admission_timeout)
+            future = Future()
+            try:
+                output = io.BytesIO()
+                with metrics.stage('optimize'):
+                    self.optimize_image(source, output, max_width)
+                future.set_result(output.getvalue())
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self._release_memory(reserved)
+            return future, b''
+
+        if isinstance(source, Path):
+            data = source.read_bytes()
+        else:
+            source.seek(0)
+            data = source.read()
+        self._record_source(io.BytesIO(data), len(data))
+        reserved = self._reserve_memory(io.BytesIO(data), max_width, admission_timeout)
+        try:
+            future = self.image_pool.submit(optimize_bytes, data, max_width)
+        except BaseException:
+            self._release_memory(reserved)
+            raise
+        # Includes time queued for a worker; the callback runs on the pool's
+        # thread, so the request's timings are captured here
+        submitted = time.perf_counter()
+        timings = metrics.current_request.get()
+
+        def done(_):
+            self._release_memory(reserved)
+            metrics.observe_stage('optimize', time.perf_counter() - submitted, timings)
+
+        future.add_done_callback(done)
+        return future, data
+
+    @staticmethod
+    def _record_source(source: Union[Path, BinaryIO], nbytes: Optional[int] = None) -> None:
+        """Count an incoming photo's bytes and pixels (header read only)"""
+        position = None if isinstance(source, Path) else source.tell()
+        try:
+            if nbytes is None and isinstance(source, Path):
+                nbytes = source.stat().st_size
+            elif nbytes is None:
+                nbytes = source.seek(0, io.SEEK_END)
+                source.seek(position)
+            with Image.open(source) as img:
+                pixels = img.width * img.height
+        except Exception:
+            pixels = 0
+        finally:
+            if position is not None:
+                source.seek(position)
+        metrics.record_image(nbytes or 0, pixels)
+
+    def _reserve_memory(self, source: Union[Path, BinaryIO], max_width: int, timeout: Optional[float]) -> int:
+        if self.memory_budget is None:
+            return 0
+        estimate = estimate_image_memory(source, max_width)
+        with metrics.stage('admission'):
+            return self.memory_budget.acquire(estimate, timeout)
+
+    def _release_memory(self, reserved: int) -> None:
+        if self.memory_budget is not None and reserved:
+            self.memory_budget.release(reserved)
+
+    def optimized_result(self, future: Future, data: bytes, max_width: int = 1600) -> bytes:
+        """Wait for submit_optimize, falling back to in-process if a worker died"""
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            logger.warning('Image worker pool broke; optimizing in-process and restarting it')
+            self._replace_broken_pool()
+            return optimize_bytes(data, max_width)
+
+    def _replace_broken_pool(self) -> None:
+        with self._pool_lock:
+            try:
+                # Another photo may have replaced the pool already
+                self.image_pool.submit(int)
+            except BrokenProcessPool:
+                self.image_pool.shutdown(wait=False)
+                self.image_pool = self._new_image_pool()
+
+    def fetch_original(self, s3_key: str) -> bytes:
+        """Download an object from the media bucket"""
+        with metrics.stage('origin_fetch'):
+            response = self.s3_client.get_object(Bucket=self.s3_bucket, Key=s3_key)
+            return response['Body'].read()
+
+    def render_variant(
+        self,
+        data: bytes,
+        width: int,
+        fmt: str,
+        admission_timeout: Optional[float] = None
+    ) -> bytes:
+        """Render one on-demand variant of an original, in the image pool if there is one
+
+        Admitted against the memory budget like uploads; raises
+        MemoryBudgetExceeded if it can't be within admission_timeout.
+        """
+        reserved = self._reserve_memory(io.BytesIO(data), width, admission_timeout)
+        try:
+            with metrics.stage('render'):
+                if self.image_pool is None:
+                    return render_variant_bytes(data, width, fmt)
+                try:
+                    return self.image_pool.submit(render_variant_bytes, data, width, fmt).result()
+                except BrokenProcessPool:
+                    logger.warning('Image worker pool broke; rendering in-process and restarting it')
+                    self._replace_broken_pool()
+                    return render_variant_bytes(data, width, fmt)
+        finally:
+            self._release_memory(reserved)
+
+    def upload_to_s3(self, file_path: Union[Path, BinaryIO], s3_key: str, content_type: str = 'image/jpeg') -> str:
+        """Upload a file path or binary file object to S3 and return public URL"""
+        extra_args = {
+            'ContentType': content_type,
+            'CacheControl': 'public, max-age=31536000',
+        }
+        with metrics.stage('upload'):
+            self._upload(file_path, s3_key, extra_args)
         # Return public URL
         return f"https://{self.s3_bucket}/{quote(s3_key)}"
 
+    def _upload(self, file_path: Union[Path, BinaryIO], s3_key: str, extra_args: Dict[str, str]) -> None:
+        if isinstance(file_path, Path):
+            self.s3_client.upload_file(
+                str(file_path),
+                self.s3_bucket,
+                s3_key,
+                ExtraArgs=extra_args,
+                Config=self.transfer_config
+            )
+        else:
+            file_path.seek(0)
+            self.s3_client.upload_fileobj(
+                file_path,
+                self.s3_bucket,
+                s3_key,
+                ExtraArgs=extra_args,
+                Config=self.transfer_config
+            )
+
+    def submit_upload(self, file_path: Union[Path, BinaryIO], s3_key: str, content_type: str = 'image/jpeg') -> Future:
+        """Queue an upload on the shared pool; blocks while too many are in flight"""
+        self.upload_slots.acquire()
+        try:
+            # Run in a copy of the caller's context so upload timings reach its request
+            future = self.upload_executor.submit(
+                contextvars.copy_context().run, self.upload_to_s3, file_path, s3_key, content_type
+            )
+        except BaseException:
+            self.upload_slots.release()
+            raise
+        future.add_done_callback(lambda _: self.upload_slots.release())
+        return future
+
     def process_gallery(
         self,
-        photos: List[Path],
+        photos: List[PhotoSource],
         title: str,
         description: str = "",
-        tags: List[str] = None
+        tags: List[str] = None,
+        on_progress: Optional[Callable[[int, str], None]] = None,
+        admission_timeout: Optional[float] = None
     ) -> Dict[str, Any]:
         """Process photos for gallery
 
         Uploads photos to S3 and creates a pending gallery manifest
         GitHub Actions will pick this up and create the markdown file
+
+        Photos may be paths or in-memory uploads; optimized copies are encoded
+        into memory either way.
+
+        on_progress, if given, is called as on_progress(photo_number, stage)
+        with stage 'optimized' and then 'uploaded' for each photo.
+
+        admission_timeout bounds how long each photo may wait for the memory
+        budget (None waits as long as it takes).
         """
         slug = slugify(title)
         date = datetime.now()
@@ -77,28 +421,72 @@ class GalleryProcessor:
         s3_base_path = f"galleries/{date_path}/{slug}"
 
         processed_photos = []
+        uploads = []
+        # Photos whose optimization is running; bounded so a 50-photo gallery
+        # doesn't read every original into memory up front
+        in_flight = deque()
+        window = max(1, self.image_workers * 2)
+
+        def finish_photo(i, optimize_future, data):
+            optimized = io.BytesIO(self.optimized_result(optimize_future, data, max_width=1200))
+            metrics.image_bytes.inc(len(optimized.getbuffer()), 'out')
+            if on_progress:
+                on_progress(i, 'optimized')
+            optimized_s3_key = f"{s3_base_path}/photo-{i:02d}_optimized.jpg"
+            optimized_upload = self.submit_upload(optimized, optimized_s3_key, 'image/jpeg')
+            full_upload = uploads[i - 1][0]
+            if on_progress:
+                self._report_when_done(
+                    (full_upload, optimized_upload),
+                    lambda: on_progress(i, 'uploaded')
+                )
+            uploads[i - 1] = (full_upload, optimized_upload)
+
+        try:
+            for i, photo in enumerate(photos, 1):
+                # Generate filenames
+                ext, source = self._photo_source(photo)
+                base_name = f"photo-{i:02d}"
 
-        for i, photo_path in enumerate(photos, 1):
-            # Generate filenames
-            ext = photo_path.suffix
-            base_name = f"photo-{i:02d}"
+                # Optimize (in the image pool when there is one) while earlier
+                # photos upload
+                optimize_future, data = self.submit_optimize(
+                    source,
+                    max_width=1200,
+                    admission_timeout=admission_timeout
+                )
 
-            # Create optimized version
-            optimized_path = photo_path.parent / f"{base_name}_optimized.jpg"
-            self.optimize_image(photo_path, optimized_path, max_width=1200)
+                # The original doesn't depend on optimization, so start it now
+                full_s3_key = f"{s3_base_path}/{base_name}{ext}"
+                uploads.append((self.submit_upload(source, full_s3_key, 'image/jpeg'), None))
 
-            # Upload both versions
-            full_s3_key = f"{s3_base_path}/{base_name}{ext}"
-            optimized_s3_key = f"{s3_base_path}/{base_name}_optimized.jpg"
+                in_flight.append((i, optimize_future, data))
+                if len(in_flight) >= window:
+                    finish_photo(*in_flight.popleft())
 
-            full_url = self.upload_to_s3(photo_path, full_s3_key, 'image/jpeg')
-            optimized_url = self.upload_to_s3(optimized_path, optimized_s3_key, 'image/jpeg')
+            while in_flight:
+                finish_photo(*in_flight.popleft())
 
-            processed_photos.append({
-                'url': optimized_url,
-                'full': full_url,
-                'alt': f"{title} - Photo {i}"
-            })
+            # Collect URLs in photo order so photo-NN numbering matches the manifest
+            for i, (full_upload, optimized_upload) in enumerate(uploads, 1):
+                processed_photos.append({
+                    'url': optimized_upload.result(),
+                    'full': full_upload.result(),
+                    'alt': f"{title} - Photo {i}"
+                })
+        except BaseException:
+            # Don't leave queued work reading files the caller is about to close
+            for _, optimize_future, _ in in_flight:
+                optimize_future.cancel()
+            for photo_uploads in uploads:
+                for upload in photo_uploads:
+                    if upload is not None:
+                        upload.cancel()
+            for photo_uploads in uploads:
+                for upload in photo_uploads:
+                    if upload is not None and not upload.cancelled():
+                        upload.exception()
+            raise
 
         gallery_data = {
             'title': title,
@@ -110,15 +498,65 @@ class GalleryProcessor:
         }
 
         # Write pending gallery manifest to S3
-        # GitHub Actions will pick this up and create the markdown file
+        # A queue watcher (or the scheduled GitHub Actions run) picks this up
+        # and creates the markdown file
         manifest_key = f"pending-galleries/{date.strftime('%Y-%m-%d')}-{slug}.json"
         manifest_json = json.dumps(gallery_data, indent=2)
 
-        self.s3_client.put_object(
-            Bucket=self.s3_bucket,
-            Key=manifest_key,
-            Body=manifest_json.encode('utf-8'),
-            ContentType='application/json'
-        )
+        with metrics.stage('manifest'):
+            self.s3_client.put_object(
+                Bucket=self.s3_bucket,
+                Key=manifest_key,
+                Body=manifest_json.encode('utf-8'),
+                ContentType='application/json'
+            )
+        self.notify_manifest(manifest_key, slug)
 
         return gallery_data
+
+    def notify_manifest(self, manifest_key: str, slug: str) -> None:
+        """Tell the pending-gallery queue a manifest is ready, if there is one
+
+        Best effort: the manifest is already in S3, so if the message is lost
+        the scheduled run still publishes the gallery, just later.
+        """
+        if self.sqs_client is None:
+            return
+        try:
+            self.sqs_client.send_message(
+                QueueUrl=self.queue_url,
+                MessageBody=json.dumps({
+                    'bucket': self.s3_bucket,
+                    'key': manifest_key,
+                    'slug': slug
+                })
+            )
+        except Exception:
+            logger.exception("Couldn't notify gallery queue about %s", manifest_key)
+
+    @staticmethod
+    def _photo_source(photo: PhotoSource) -> Tuple[str, Union[Path, BinaryIO]]:
+        """Return (extension, path or rewound stream) for a photo"""
+        if isinstance(photo, Path):
+            return photo.suffix, photo
+        stream = photo.stream
+        stream.seek(0)
+        return Path(photo.filename or '').suffix, stream
+
+    @staticmethod
+    def _report_when_done(futures, callback: Callable[[], None]) -> None:
+        """Call callback once every future has finished successfully"""
+        remaining = [len(futures)]
+        lock = threading.Lock()
+
+        def done(future: Future):
+            if future.cancelled() or future.exception() is not None:
+                return
+            with lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+            if finished:
+                callback()
+
+        for future in futures:
+            future.add_done_callback(done)
@@ -0,0 +1,90 @@
+"""Fast downscaling shared by gallery-service and tools/process_photos.py
+
+A full decode of a 48MP JPEG only to shrink it to 320px wastes most of the
+work. load_resized asks libjpeg to decode at a reduced DCT scale (1/2, 1/4
+or 1/8) that still leaves at least DRAFT_OVERSAMPLE times the target size,
+then finishes with LANCZOS, using Pillow's reducing_gap to do the first part
+of any remaining large reduction with a cheap box reduce. Non-JPEG sources
+skip the draft step and just get the reducing_gap speedup.
+"""
+
+from pathlib import Path
+from typing import BinaryIO, Tuple, Union
+
+from PIL import Image
+
+# Keep at least this much resolution above the target before the final
+# LANCZOS pass, and let reduce() handle ratios beyond REDUCING_GAP; both
+# values keep output visually indistinguishable from a full-decode resize
+DRAFT_OVERSAMPLE = 2
+REDUCING_GAP = 3.0
+
+
+def scaled_size(size: Tuple[int, int], width: int) -> Tuple[int, int]:
+    """(width, height) for an image of the given size resized to width"""
+    return width, int(width * size[1] / size[0])
+
+
+def resize_to_width(img: Image.Image, width: int) -> Image.Image:
+    """Downscale an already-decoded image to width (never upscales)"""
+    if img.width <= width:
+        return img
+    return img.resize(
+        scaled_size(img.size, width),
+        Image.Resampling.LANCZOS,
+        reducing_gap=REDUCING_GAP
+    )
+
+
+def draft_scale(size: Tuple[int, int], width: int) -> int:
+    """Reduction factor load_resized decodes a JPEG of this size at"""
+    if size[0] <= width:
+        return 1
+    target = scaled_size(size, width)
+    ratio = min(
+        size[0] // (target[0] * DRAFT_OVERSAMPLE),
+        size[1] // max(1, target[1] * DRAFT_OVERSAMPLE)
+    )
+    for scale in (8, 4, 2):
+        if ratio >= scale:
+            return scale
+    return 1
+
+
+def load_resized(
+    source: Union[Path, BinaryIO],
+    width: int,
+    rgb_modes: Tuple[str, ...] = ()
+) -> Image.Image:
+    """Decode source at the smallest useful scale and resize it to width
+
+    Output dimensions match a full decode followed by a LANCZOS resize to
+    width (images narrower than width keep their size). Images in one of
+    rgb_modes are converted to RGB first. The returned image no longer
+    depends on source.
+    """
+    with Image.open(source) as opened:
+        img = opened
+        original_size = img.size
+        box = None
+
+        if img.width > width:
+            target = scaled_size(original_size, width)
+            drafted = img.draft(None, (target[0] * DRAFT_OVERSAMPLE, target[1] * DRAFT_OVERSAMPLE))
+            if drafted:
+                # Crop away the partial-block padding a scaled decode can add
+                box = drafted[1]
+
+        if img.mode in rgb_modes:
+            img = img.convert('RGB')
+
+        if original_size[0] <= width:
+            # Detach from the file, which closes when we return
+            return img.copy() if img is opened else img
+
+        return img.resize(
+            scaled_size(original_size, width),
+            Image.Resampling.LANCZOS,
+            box=box,
+            reducing_gap=REDUCING_GAP
+        )
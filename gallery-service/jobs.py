@@ -0,0 +1,151 @@
+"""Background gallery jobs
+
+Lets POST /gallery answer right away: uploads are spooled to disk, a small
+thread pool runs GalleryProcessor.process_gallery, and per-photo progress is
+kept in memory for GET /gallery/jobs/<id>.
+"""
+
+import logging
+import re
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class GalleryJobs:
+    """Runs gallery processing off the request thread and tracks its status"""
+
+    def __init__(self, processor, spool_dir: Path, workers: int = 2, ttl_seconds: int = 3600):
+        self.processor = processor
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self._remove_stale_spools()
+        self.ttl_seconds = ttl_seconds
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gallery-job')
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._finished_at: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _remove_stale_spools(self):
+        """Delete job directories left by an earlier process
+
+        Jobs only live in memory, so nothing can resume them after a restart.
+        Runs before any job is created; the service has a single worker.
+        """
+        for path in self.spool_dir.iterdir():
+            # Only job directories (uuid4 hex names), in case the spool dir is shared
+            if path.is_dir() and re.fullmatch(r'[0-9a-f]{32}', path.name):
+                shutil.rmtree(path, ignore_errors=True)
+
+    def create_job_dir(self) -> tuple:
+        """Reserve a job id and the directory its uploads are spooled into"""
+        job_id = uuid.uuid4().hex
+        job_dir = self.spool_dir / job_id
+        job_dir.mkdir(parents=True)
+        return job_id, job_dir
+
+    def submit(
+        self,
+        job_id: str,
+        photo_paths: List[Path],
+        title: str,
+        description: str = "",
+        tags: List[str] = None
+    ) -> Dict[str, Any]:
+        """Queue a gallery for background processing and return its status"""
+        now = datetime.now().isoformat()
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'title': title,
+            'slug': None,
+            'url': None,
+            'error': None,
+            'photo_count': len(photo_paths),
+            'photos_done': 0,
+            'photos': [
+                {'index': i, 'status': 'pending'}
+                for i in range(1, len(photo_paths) + 1)
+            ],
+            'created_at': now,
+            'updated_at': now,
+        }
+
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = job
+            snapshot = self._snapshot(job)
+
+        self._executor.submit(self._run, job_id, photo_paths, title, description, tags)
+        return snapshot
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a copy of the job's current status, or None if unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._snapshot(job) if job else None
+
+    def _run(self, job_id: str, photo_paths: List[Path], title: str, description: str, tags: List[str]):
+        self._update(job_id, status='processing')
+
+        def on_progress(index: int, stage: str):
+            with self._lock:
+                job = self._jobs[job_id]
+                photo = job['photos'][index - 1]
+                if photo['status'] == 'uploaded':
+                    return
+                photo['status'] = stage
+                if stage == 'uploaded':
+                    job['photos_done'] += 1
+                job['updated_at'] = datetime.now().isoformat()
+
+        try:
+            gallery_data = self.processor.process_gallery(
+                photos=photo_paths,
+                title=title,
+                description=description,
+                tags=tags,
+                on_progress=on_progress
+            )
+            # Upload callbacks can trail the result by a moment
+            for i in range(1, len(photo_paths) + 1):
+                on_progress(i, 'uploaded')
+            self._update(
+                job_id,
+                status='complete',
+                slug=gallery_data['slug'],
+                url=f"https://clintecker.com/galleries/{gallery_data['slug']}/"
+            )
+        except Exception as e:
+            # The job only keeps the message, and only until it is pruned
+            logger.exception('Gallery job %s failed', job_id)
+            self._update(job_id, status='failed', error=str(e))
+        finally:
+            shutil.rmtree(self.spool_dir / job_id, ignore_errors=True)
+            with self._lock:
+                self._finished_at[job_id] = time.monotonic()
+
+    def _update(self, job_id: str, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job['updated_at'] = datetime.now().isoformat()
+
+    def _prune(self):
+        """Forget finished jobs older than the TTL (caller holds the lock)"""
+        cutoff = time.monotonic() - self.ttl_seconds
+        for job_id, finished in list(self._finished_at.items()):
+            if finished < cutoff:
+                del self._finished_at[job_id]
+                self._jobs.pop(job_id, None)
+
+    @staticmethod
+    def _snapshot(job: Dict[str, Any]) -> Dict[str, Any]:
+        return {**job, 'photos': [dict(p) for p in job['photos']]}
@@ -0,0 +1,218 @@
+"""In-process metrics for gallery-service
+
+Stage latency histograms, byte and pixel counts and S3 retry counters,
+rendered in the Prometheus text format at /metrics. Recording is a lock
+and a few additions, cheap enough to leave on for every request.
+
+Timings are also collected per request: stage() adds its duration to the
+request's RequestTimings (carried in a contextvar, which the upload pool
+copies into its threads) and app.py turns them into a Server-Timing header.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Seconds; covers a single S3 PUT up to a 50-photo gallery
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Megapixels per photo, from thumbnails to 48MP sensors
+PIXEL_BUCKETS = (0.5, 1, 2, 4, 8, 12, 16, 24, 48, 64)
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    """Monotonic counter with optional labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                label_text = _format_labels(self.labelnames, labels)
+                lines.append(f'{self.name}{label_text} {_format_value(value)}')
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        buckets: Iterable[float],
+        labelnames: Tuple[str, ...] = ()
+    ):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = labelnames
+        # labels -> [per-bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                    label_text = _format_labels(self.labelnames, labels, f'le="{le}"')
+                    lines.append(f'{self.name}_bucket{label_text} {cumulative}')
+                label_text = _format_labels(self.labelnames, labels)
+                lines.append(f'{self.name}_sum{label_text} {_format_value(total)}')
+                lines.append(f'{self.name}_count{label_text} {cumulative}')
+        return lines
+
+
+stage_seconds = Histogram(
+    'gallery_stage_seconds',
+    'Time spent in each gallery processing stage',
+    LATENCY_BUCKETS,
+    ('stage',)
+)
+request_seconds = Histogram(
+    'gallery_http_request_seconds',
+    'HTTP request latency',
+    LATENCY_BUCKETS,
+    ('endpoint', 'status')
+)
+image_bytes = Counter(
+    'gallery_image_bytes_total',
+    'Image bytes received from clients (in) and produced by optimization (out)',
+    ('direction',)
+)
+image_megapixels = Histogram(
+    'gallery_image_megapixels',
+    'Size of uploaded photos',
+    PIXEL_BUCKETS
+)
+s3_requests = Counter('gallery_s3_requests_total', 'S3 API calls', ('operation',))
+s3_retries = Counter(
+    'gallery_s3_retries_total',
+    'Retries botocore made before an S3 call completed',
+    ('operation',)
+)
+
+image_cache_requests = Counter(
+    'gallery_image_cache_requests_total',
+    'On-demand image requests by cache outcome (hit, miss, coalesced)',
+    ('result',)
+)
+
+REGISTRY = (
+    stage_seconds, request_seconds, image_bytes, image_megapixels, s3_requests, s3_retries,
+    image_cache_requests
+)
+
+
+class RequestTimings:
+    """Per-request totals for the Server-Timing header
+
+    Stages that run once per photo on several threads are summed, so their
+    total can exceed the request's wall time.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._totals: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            total = self._totals.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+
+    def server_timing(self) -> str:
+        with self._lock:
+            entries = [
+                f'{stage};dur={seconds * 1000:.1f}' + (f';desc="{count}x"' if count > 1 else '')
+                for stage, (seconds, count) in self._totals.items()
+            ]
+        entries.append(f'total;dur={(time.perf_counter() - self.started) * 1000:.1f}')
+        return ', '.join(entries)
+
+
+current_request: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    'current_request', default=None
+)
+
+
+def observe_stage(stage: str, seconds: float, timings: Optional[RequestTimings] = None) -> None:
+    """Record a stage duration globally and on the current (or given) request"""
+    stage_seconds.observe(seconds, stage)
+    timings = timings or current_request.get()
+    if timings is not None:
+        timings.add(stage, seconds)
+
+
+@contextmanager
+def stage(name: str):
+    """Time the enclosed block as one occurrence of a stage"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(name, time.perf_counter() - started)
+
+
+def record_image(nbytes: int, pixels: int) -> None:
+    image_bytes.inc(nbytes, 'in')
+    if pixels:
+        image_megapixels.observe(pixels / 1e6)
+
+
+def record_s3_call(http_response=None, parsed=None, model=None, **kwargs) -> None:
+    """botocore after-call hook: count the call and the retries it needed"""
+    operation = getattr(model, 'name', 'unknown')
+    s3_requests.inc(1, operation)
+    retries = ((parsed or {}).get('ResponseMetadata') or {}).get('RetryAttempts', 0)
+    if retries:
+        s3_retries.inc(retries, operation)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
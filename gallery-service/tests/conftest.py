@@ -0,0 +1,63 @@
+"""Fixtures that run the Flask app against moto's in-memory AWS"""
+
+import importlib
+import io
+import os
+import sys
+import time
+from pathlib import Path
+from unittest import mock
+
+import boto3
+import pytest
+from moto import mock_aws
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+API_KEY = 'test-key'
+BUCKET = 'i.clintecker.com'
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    """app, imported once with test settings; AWS is mocked for the whole session"""
+    env = {
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'AWS_REGION': 'us-east-1',
+        'S3_MEDIA_BUCKET': BUCKET,
+        'GALLERY_API_KEY': API_KEY,
+        'IMAGE_WORKERS': '0',
+        'GALLERY_JOB_SPOOL_DIR': str(tmp_path_factory.mktemp('spool')),
+        'IMAGE_CACHE_DIR': str(tmp_path_factory.mktemp('image-cache')),
+    }
+    with mock.patch.dict(os.environ, env), mock_aws():
+        boto3.client('s3', region_name='us-east-1').create_bucket(Bucket=BUCKET)
+        yield importlib.import_module('app')
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def s3(app_module):
+    return boto3.client('s3', region_name='us-east-1')
+
+
+def jpeg(color, size=(64, 48)) -> io.BytesIO:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG', quality=95)
+    buffer.seek(0)
+    return buffer
+
+
+def wait_for_job(client, job_id: str, timeout: float = 30) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        job = client.get(f'/gallery/jobs/{job_id}', headers={'X-API-Key': API_KEY}).get_json()['job']
+        if job['status'] in ('complete', 'failed') or time.monotonic() > deadline:
+            return job
+        time.sleep(0.05)
@@ -0,0 +1,102 @@
+"""MemoryBudget admission and the 503 + Retry-After it turns into"""
+
+import io
+import threading
+import time
+
+import pytest
+from PIL import Image
+
+from admission import MemoryBudget, MemoryBudgetExceeded, estimate_image_memory
+from conftest import API_KEY, jpeg
+
+
+def test_acquire_waits_for_release():
+    budget = MemoryBudget(100)
+    budget.acquire(80)
+    admitted = threading.Event()
+
+    def second():
+        budget.acquire(50, timeout=5)
+        admitted.set()
+
+    thread = threading.Thread(target=second)
+    thread.start()
+    time.sleep(0.05)
+    assert not admitted.is_set()
+    assert budget.saturated()
+
+    budget.release(80)
+    thread.join(5)
+    assert admitted.is_set()
+    assert budget.in_use == 50
+
+
+def test_acquire_times_out_with_retry_after():
+    budget = MemoryBudget(100, retry_after=7)
+    budget.acquire(100)
+    with pytest.raises(MemoryBudgetExceeded) as excinfo:
+        budget.acquire(1, timeout=0.01)
+    assert excinfo.value.retry_after == 7
+    assert budget.in_use == 100 and budget.waiting == 0
+
+
+def test_oversized_work_is_clamped_and_runs_alone():
+    budget = MemoryBudget(100)
+    assert budget.acquire(1000, timeout=0) == 100
+    assert budget.saturated()
+    budget.release(100)
+    assert not budget.saturated()
+
+
+def test_reserve_releases_on_error():
+    budget = MemoryBudget(100)
+    with pytest.raises(RuntimeError):
+        with budget.reserve(60):
+            raise RuntimeError
+    assert budget.in_use == 0
+
+
+def test_estimate_uses_the_reduced_jpeg_decode():
+    buffer = io.BytesIO()
+    Image.new('RGB', (4000, 3000), 'gray').save(buffer, 'JPEG')
+    buffer.seek(0)
+
+    # 768w decodes at 1/2 scale (keeping 2x oversampling), then resizes to 768x576
+    assert estimate_image_memory(buffer, 768) == 2000 * 1500 * 3 + 768 * 576 * 3
+    # Wider targets need the full decode
+    assert estimate_image_memory(buffer, 1600) == 4000 * 3000 * 3 + 1600 * 1200 * 3
+    assert buffer.tell() == 0
+
+
+def test_saturated_budget_turns_sync_uploads_away(app_module, client):
+    budget = app_module.memory_budget
+    reserved = budget.acquire(budget.limit_bytes)
+    try:
+        response = client.post(
+            '/gallery',
+            headers={'X-API-Key': API_KEY},
+            data={'title': 'Busy', 'photos': [(jpeg('red'), 'a.jpg')]},
+            content_type='multipart/form-data'
+        )
+    finally:
+        budget.release(reserved)
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(budget.retry_after)
+    assert 'busy' in response.get_json()['error']
+
+
+def test_admission_timeout_is_a_503(app_module, client, monkeypatch):
+    def exceeded(**kwargs):
+        raise MemoryBudgetExceeded(retry_after=12)
+
+    monkeypatch.setattr(app_module.processor, 'process_gallery', exceeded)
+    response = client.post(
+        '/gallery',
+        headers={'X-API-Key': API_KEY},
+        data={'title': 'Timed out', 'photos': [(jpeg('red'), 'a.jpg')]},
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '12'
@@ -0,0 +1,144 @@
+"""DiskLRUCache: request coalescing, eviction and reload, and /img on top of it"""
+
+import os
+import threading
+import time
+
+import pytest
+
+from conftest import BUCKET, jpeg
+from disk_cache import DiskLRUCache
+
+
+def test_miss_then_hit(tmp_path):
+    cache = DiskLRUCache(tmp_path, 1024)
+    assert cache.get_or_create('a', lambda: b'rendered') == (b'rendered', 'miss')
+    assert cache.get_or_create('a', lambda: pytest.fail('create called on a hit')) == (b'rendered', 'hit')
+
+
+def test_concurrent_misses_share_one_create(tmp_path):
+    cache = DiskLRUCache(tmp_path, 1024)
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def create():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return b'rendered'
+
+    results = []
+
+    def request():
+        results.append(cache.get_or_create('a', create))
+
+    owner = threading.Thread(target=request)
+    owner.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=request) for _ in range(8)]
+    for thread in waiters:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in [owner, *waiters]:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert sorted(outcome for _, outcome in results) == ['coalesced'] * 8 + ['miss']
+    assert all(data == b'rendered' for data, _ in results)
+    assert not cache._inflight
+
+
+def test_failed_create_reaches_every_waiter_and_caches_nothing(tmp_path):
+    cache = DiskLRUCache(tmp_path, 1024)
+    started = threading.Event()
+    release = threading.Event()
+
+    def create():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('S3 is down')
+
+    errors = []
+
+    def request():
+        try:
+            cache.get_or_create('a', create)
+        except RuntimeError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=request)]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    time.sleep(0.1)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert [str(e) for e in errors] == ['S3 is down'] * 4
+    assert cache.get('a') is None and cache.total_bytes == 0
+    # The next request tries again
+    assert cache.get_or_create('a', lambda: b'ok') == (b'ok', 'miss')
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    cache = DiskLRUCache(tmp_path, 25)
+    cache.put('a', b'a' * 10)
+    cache.put('b', b'b' * 10)
+    cache.get('a')
+    cache.put('c', b'c' * 10)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == b'a' * 10 and cache.get('c') == b'c' * 10
+    assert cache.total_bytes == 20
+    assert len(os.listdir(tmp_path)) == 2
+
+    cache.put('huge', b'x' * 26)
+    assert cache.get('huge') is None and cache.total_bytes == 20
+
+
+def test_reload_keeps_entries_and_recency(tmp_path):
+    cache = DiskLRUCache(tmp_path, 25)
+    cache.put('old', b'o' * 10)
+    cache.put('new', b'n' * 10)
+    os.utime(tmp_path / cache._name('old'), (1_000, 1_000))
+    (tmp_path / '.tmp-leftover').write_bytes(b'partial')
+
+    reloaded = DiskLRUCache(tmp_path, 25)
+    assert reloaded.total_bytes == 20
+    assert not (tmp_path / '.tmp-leftover').exists()
+    assert reloaded.get_or_create('new', lambda: b'') == (b'n' * 10, 'hit')
+
+    # 'old' has the oldest access time, so it goes first
+    reloaded.put('third', b't' * 10)
+    assert reloaded.get('old') is None and reloaded.get('new') == b'n' * 10
+
+
+def test_img_renders_once_then_serves_from_cache(client, s3):
+    s3.put_object(Bucket=BUCKET, Key='galleries/cache-test/a.jpg', Body=jpeg('red', (800, 600)).read())
+
+    first = client.get('/img/galleries/cache-test/a.jpg?w=320&fmt=jpg')
+    second = client.get('/img/galleries/cache-test/a.jpg?w=320&fmt=jpg')
+    assert first.status_code == 200 and first.headers['X-Cache'] == 'miss'
+    assert second.status_code == 200 and second.headers['X-Cache'] == 'hit'
+    assert first.data == second.data and first.mimetype == 'image/jpeg'
+
+
+def test_img_is_busy_without_fetching_when_the_budget_is_saturated(app_module, client, monkeypatch):
+    def fetch_original(key):
+        pytest.fail('original fetched while the budget was saturated')
+
+    monkeypatch.setattr(app_module.processor, 'fetch_original', fetch_original)
+    budget = app_module.memory_budget
+    reserved = budget.acquire(budget.limit_bytes)
+    try:
+        response = client.get('/img/galleries/busy/a.jpg?w=320&fmt=jpg')
+    finally:
+        budget.release(reserved)
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(budget.retry_after)
@@ -0,0 +1,74 @@
+"""Background gallery jobs: spooling, processing and failure reporting"""
+
+import io
+import json
+import logging
+
+from PIL import Image
+
+from conftest import API_KEY, BUCKET, jpeg, wait_for_job
+
+
+def photo_colors(s3, gallery: dict) -> list:
+    colors = []
+    for photo in gallery['photos']:
+        key = photo['full'].split(f'{BUCKET}/', 1)[1]
+        body = s3.get_object(Bucket=BUCKET, Key=key)['Body'].read()
+        colors.append(Image.open(io.BytesIO(body)).convert('RGB').getpixel((0, 0)))
+    return colors
+
+
+def test_async_upload_keeps_photos_that_share_a_name(client, s3):
+    response = client.post(
+        '/gallery?async=1',
+        headers={'X-API-Key': API_KEY},
+        data={
+            'title': 'Same names',
+            'photos': [(jpeg('red'), 'image.jpg'), (jpeg('blue'), 'image.jpg')],
+        },
+        content_type='multipart/form-data'
+    )
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()['job']['id'])
+    assert job['status'] == 'complete'
+
+    listing = s3.list_objects_v2(Bucket=BUCKET, Prefix='pending-galleries/')['Contents']
+    key = next(obj['Key'] for obj in listing if obj['Key'].endswith('-same-names.json'))
+    gallery = json.loads(s3.get_object(Bucket=BUCKET, Key=key)['Body'].read())
+    red, blue = photo_colors(s3, gallery)
+    assert red[0] > 200 and red[2] < 50
+    assert blue[2] > 200 and blue[0] < 50
+
+
+def test_save_photos_names_files_by_position(app_module, tmp_path):
+    from werkzeug.datastructures import FileStorage
+
+    photos = [
+        FileStorage(jpeg('red'), filename='../../etc/passwd.jpg'),
+        FileStorage(jpeg('red'), filename='image.JPG'),
+        FileStorage(jpeg('red'), filename='..'),
+        FileStorage(jpeg('red'), filename=''),
+    ]
+    paths = app_module.save_photos(photos, tmp_path)
+    assert [p.name for p in paths] == ['photo-00.jpg', 'photo-01.JPG', 'photo-02']
+    assert all(p.is_file() and p.parent == tmp_path for p in paths)
+
+
+def test_failed_job_is_logged_with_traceback(app_module, client, caplog, monkeypatch):
+    def explode(**kwargs):
+        raise RuntimeError('S3 is down')
+
+    monkeypatch.setattr(app_module.processor, 'process_gallery', explode)
+    with caplog.at_level(logging.ERROR, logger='jobs'):
+        response = client.post(
+            '/gallery?async=1',
+            headers={'X-API-Key': API_KEY},
+            data={'title': 'Broken', 'photos': [(jpeg('red'), 'a.jpg')]},
+            content_type='multipart/form-data'
+        )
+        job = wait_for_job(client, response.get_json()['job']['id'])
+
+    assert job['status'] == 'failed' and job['error'] == 'S3 is down'
+    record = next(r for r in caplog.records if r.name == 'jobs')
+    assert job['id'] in record.getMessage()
+    assert record.exc_info[1].args == ('S3 is down',)
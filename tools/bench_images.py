@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Benchmark the image pipeline on synthetic phone-camera photos.
+
+Stages measured, per fixture:
+
+  optimize   gallery-service's optimize step (optimize_bytes, 1600px JPEG)
+  render     process_photos.render_variants for each width in VARIANT_SIZES
+             on its own, and for all widths together as the build runs it
+  hash       streaming SHA-256 and EXIF read, as _download_photo does
+  quality    PSNR of load_resized (draft decode + reducing_gap) against a
+             full decode and plain LANCZOS resize, per width
+
+Fixtures are JPEG, PNG, RGBA PNG and palette PNG images with noise and
+gradients (so encoders have real work to do), generated once into
+--fixtures. Fixture generation and each measurement run in fresh
+interpreters: Linux carries ru_maxrss across fork and exec, so a child of
+a process that has already held a big image would report that peak.
+
+    python tools/bench_images.py --save baseline.json
+    python tools/bench_images.py --baseline baseline.json   # exit 1 on regressions
+"""
+
+import argparse
+import hashlib
+import io
+import json
+import math
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import exifread
+from PIL import Image, ImageChops, ImageStat
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gallery-service"))
+from gallery_processor import optimize_bytes  # noqa: E402
+from imaging import load_resized, resize_to_width  # noqa: E402
+
+from process_photos import (  # noqa: E402
+    DOWNLOAD_CHUNK_BYTES,
+    EXIF_HEADER_BYTES,
+    VARIANT_SIZES,
+    render_variants,
+)
+
+# name -> (format, mode, (width, height)); 12MP is the common phone default
+FIXTURES = {
+    "12mp.jpg": ("JPEG", "RGB", (4032, 3024)),
+    "12mp.png": ("PNG", "RGB", (4032, 3024)),
+    "12mp-rgba.png": ("PNG", "RGBA", (4032, 3024)),
+    "12mp-palette.png": ("PNG", "P", (4032, 3024)),
+}
+# Added with --full: the 48MP mode of recent phones
+FULL_FIXTURES = {
+    "48mp.jpg": ("JPEG", "RGB", (8064, 6048)),
+}
+
+# Allowed drift against a baseline before a result counts as a regression
+DEFAULT_TOLERANCE = 0.15
+BYTES_TOLERANCE = 0.02
+PSNR_TOLERANCE_DB = 0.5
+# Below this the fast resize is visibly different from the reference. The
+# noise in the fixtures is a worst case for resampling; real photos score
+# well above 50dB
+MIN_PSNR_DB = 35.0
+# Reported for identical images, instead of infinity
+MAX_PSNR_DB = 100.0
+
+
+def make_fixture(path: Path, fmt: str, mode: str, size):
+    """Write a noisy gradient image, roughly as hard to compress as a photo."""
+    gradient = Image.linear_gradient("L").resize(size)
+    noise = Image.effect_noise(size, 48)
+    img = Image.merge("RGB", (gradient, noise, gradient.rotate(180)))
+    if mode == "RGBA":
+        img.putalpha(gradient.transpose(Image.Transpose.FLIP_LEFT_RIGHT))
+    elif mode == "P":
+        img = img.quantize(256)
+    save_args = {"quality": 92} if fmt == "JPEG" else {"compress_level": 1}
+    img.save(path, fmt, **save_args)
+
+
+def all_fixtures(full: bool = True) -> Dict[str, tuple]:
+    return dict(FIXTURES, **(FULL_FIXTURES if full else {}))
+
+
+def ensure_fixtures(fixture_dir: Path, full: bool) -> Dict[str, Path]:
+    fixture_dir.mkdir(parents=True, exist_ok=True)
+    fixtures = all_fixtures(full)
+    paths = {}
+    for name in fixtures:
+        path = fixture_dir / name
+        if not path.exists():
+            print(f"Generating {path}")
+            subprocess.run(
+                [sys.executable, __file__, "--make-fixture", name, str(path)], check=True
+            )
+        paths[name] = path
+    return paths
+
+
+def psnr(a: Image.Image, b: Image.Image) -> float:
+    """Peak signal-to-noise ratio of two same-sized RGB images, in dB."""
+    diff = ImageChops.difference(a.convert("RGB"), b.convert("RGB"))
+    mse = sum(ImageStat.Stat(diff).sum2) / (a.width * a.height * 3)
+    if mse == 0:
+        return MAX_PSNR_DB
+    return min(10 * math.log10(255 ** 2 / mse), MAX_PSNR_DB)
+
+
+def reference_resize(path: Path, width: int) -> Image.Image:
+    """Full decode and LANCZOS resize, no draft or reducing_gap."""
+    with Image.open(path) as img:
+        img.load()
+        if img.width <= width:
+            return img.copy()
+        return img.resize(
+            (width, int(width * img.height / img.width)), Image.Resampling.LANCZOS
+        )
+
+
+def run_stage(stage: str, path: Path, width: Optional[int], repeat: int) -> Dict:
+    """Run one measurement in this process; returns the result fields."""
+    data = path.read_bytes()
+    with Image.open(path) as img:
+        pixels = img.width * img.height
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    timings = []
+    output_bytes = 0
+    extra = {}
+    with tempfile.TemporaryDirectory() as out_dir:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if stage == "optimize":
+                output_bytes = len(optimize_bytes(data, width))
+            elif stage == "render":
+                sizes = [width] if width else list(VARIANT_SIZES)
+                rendered = render_variants(path, Path(out_dir), "bench", sizes)
+                output_bytes = sum(
+                    p.stat().st_size for formats in rendered.values() for p in formats.values()
+                )
+            elif stage == "hash":
+                sha256 = hashlib.sha256()
+                header = bytearray()
+                stream = io.BytesIO(data)
+                for chunk in iter(lambda: stream.read(DOWNLOAD_CHUNK_BYTES), b""):
+                    sha256.update(chunk)
+                    if len(header) < EXIF_HEADER_BYTES:
+                        header += chunk[: EXIF_HEADER_BYTES - len(header)]
+                exifread.process_file(io.BytesIO(header), details=False)
+                sha256.hexdigest()
+            elif stage == "quality":
+                fast = resize_to_width(load_resized(path, width), width)
+                extra["psnr_db"] = round(psnr(fast, reference_resize(path, width)), 2)
+            else:
+                raise ValueError(f"Unknown stage {stage}")
+            timings.append(time.perf_counter() - start)
+
+    seconds = min(timings)
+    rss_peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is KB on Linux, bytes on macOS
+    rss_unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "seconds": round(seconds, 4),
+        "megapixels_per_s": round(pixels / 1e6 / seconds, 2),
+        "mb_per_s": round(len(data) / 1e6 / seconds, 2),
+        "peak_rss_mb": round(rss_peak * rss_unit / 1e6, 1),
+        "rss_growth_mb": round((rss_peak - rss_before) * rss_unit / 1e6, 1),
+        "output_bytes": output_bytes,
+        **extra,
+    }
+
+
+def measure(stage: str, path: Path, width: Optional[int], repeat: int) -> Dict:
+    """Run one measurement in a fresh interpreter, for an isolated peak RSS."""
+    command = [
+        sys.executable, __file__, "--run-one", stage, str(path), str(width or 0),
+        "--repeat", str(repeat),
+    ]
+    result = subprocess.run(command, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def plan(fixtures: Dict[str, Path]) -> List[tuple]:
+    """(key, stage, fixture path, width) for every measurement."""
+    runs = []
+    for name, path in fixtures.items():
+        runs.append((f"optimize/{name}/1600w", "optimize", path, 1600))
+        for width in VARIANT_SIZES:
+            runs.append((f"render/{name}/{width}w", "render", path, width))
+        runs.append((f"render/{name}/all", "render", path, None))
+        runs.append((f"hash/{name}", "hash", path, None))
+        for width in VARIANT_SIZES:
+            runs.append((f"quality/{name}/{width}w", "quality", path, width))
+    return runs
+
+
+def regressions(results: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Describe every result that got meaningfully worse than the baseline."""
+    found = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        checks = [
+            ("seconds", tolerance),
+            ("peak_rss_mb", tolerance),
+            ("output_bytes", BYTES_TOLERANCE),
+        ]
+        for field, allowed in checks:
+            if base.get(field) and result[field] > base[field] * (1 + allowed):
+                found.append(
+                    f"{key}: {field} {base[field]} -> {result[field]} "
+                    f"(+{(result[field] / base[field] - 1) * 100:.0f}%)"
+                )
+        if "psnr_db" in result and "psnr_db" in base:
+            if result["psnr_db"] < base["psnr_db"] - PSNR_TOLERANCE_DB:
+                found.append(f"{key}: psnr_db {base['psnr_db']} -> {result['psnr_db']}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--fixtures",
+        type=Path,
+        default=Path(tempfile.gettempdir()) / "bench-image-fixtures",
+        help="Where synthetic fixtures are generated and reused",
+    )
+    parser.add_argument("--full", action="store_true", help="Also run the 48MP fixture")
+    parser.add_argument("--only", help="Run only measurements whose key contains this")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per measurement (best is kept)")
+    parser.add_argument("--save", type=Path, help="Write results as a baseline JSON file")
+    parser.add_argument("--baseline", type=Path, help="Compare against a saved baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Allowed slowdown/RSS growth before flagging (default 0.15 = 15%%)",
+    )
+    parser.add_argument("--run-one", nargs=3, metavar=("STAGE", "PATH", "WIDTH"), help=argparse.SUPPRESS)
+    parser.add_argument("--make-fixture", nargs=2, metavar=("NAME", "PATH"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.make_fixture:
+        name, path = args.make_fixture
+        make_fixture(Path(path), *all_fixtures()[name])
+        return
+
+    if args.run_one:
+        stage, path, width = args.run_one
+        print(json.dumps(run_stage(stage, Path(path), int(width) or None, args.repeat)))
+        return
+
+    fixtures = ensure_fixtures(args.fixtures, args.full)
+    runs = [run for run in plan(fixtures) if not args.only or args.only in run[0]]
+
+    results = {}
+    low_quality = []
+    print(
+        f"{'measurement':<38} {'ms':>8} {'MP/s':>7} {'RSS MB':>7} {'+RSS':>6} "
+        f"{'out KB':>8} {'PSNR':>6}"
+    )
+    for key, stage, path, width in runs:
+        result = measure(stage, path, width, args.repeat)
+        results[key] = result
+        psnr_db = result.get("psnr_db")
+        print(
+            f"{key:<38} {result['seconds'] * 1000:8.1f} {result['megapixels_per_s']:7.1f} "
+            f"{result['peak_rss_mb']:7.1f} {result['rss_growth_mb']:6.1f} "
+            f"{result['output_bytes'] / 1024:8.1f} "
+            f"{psnr_db if psnr_db is not None else '':>6}"
+        )
+        if psnr_db is not None and psnr_db < MIN_PSNR_DB:
+            low_quality.append(f"{key}: PSNR {psnr_db}dB is below {MIN_PSNR_DB}dB")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        print(f"Saved baseline to {args.save}")
+
+    failures = list(low_quality)
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            failures += regressions(results, json.load(f), args.tolerance)
+
+    if failures:
+        print(f"\n{len(failures)} regressions:")
+        for failure in failures:
+            print(f"  {failure}")
+        sys.exit(1)
+    if args.baseline:
+        print(f"\nNo regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
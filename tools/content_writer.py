@@ -0,0 +1,91 @@
+"""Atomic, write-if-changed output for generated content.
+
+Hugo's incremental rebuilds and the workflow's `git add` both key off files
+changing, so regenerating a page with identical bytes should leave it alone.
+ContentEmitter compares new content with what is on disk, skips identical
+files, and replaces changed ones via a temp file and rename so a crashed run
+never leaves half a page behind.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+
+HASH_CHUNK_BYTES = 64 * 1024
+
+
+def _file_digest(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _default_mode() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+class ContentEmitter:
+    """Writes files only when their content changes, counting both outcomes.
+
+    Safe to share between threads.
+    """
+
+    def __init__(self):
+        self.written = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+
+    def unchanged(self, path: Path, data: bytes) -> bool:
+        """True if path already holds exactly data."""
+        try:
+            if path.stat().st_size != len(data):
+                return False
+        except FileNotFoundError:
+            return False
+        return _file_digest(path) == hashlib.sha256(data).hexdigest()
+
+    def write_bytes(self, path: Path, data: bytes) -> bool:
+        """Atomically write data to path unless it's already there.
+
+        Returns True if the file was written, False if it was unchanged.
+        """
+        path = Path(path)
+        if self.unchanged(path, data):
+            with self._lock:
+                self.skipped += 1
+            return False
+
+        try:
+            mode = path.stat().st_mode & 0o777
+        except FileNotFoundError:
+            mode = _default_mode()
+
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                # On disk before the rename, so callers can act on it being durable
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp_path, mode)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            self.written += 1
+        return True
+
+    def write_text(self, path: Path, text: str) -> bool:
+        """write_bytes for UTF-8 text."""
+        return self.write_bytes(path, text.encode("utf-8"))
+
+    def summary(self) -> str:
+        return f"{self.written} files written, {self.skipped} unchanged"
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""Deploy the built site to S3, uploading only what changed.
+
+Replaces `aws s3 sync public/ --delete` plus wildcard CloudFront
+invalidations. The bucket holds a manifest of the last deploy (path ->
+MD5, size, Content-Type, Cache-Control) under _deploy/, a prefix the bucket
+policy hides from CloudFront (see AWS_SETUP.md); each run hashes public/, uploads
+new and changed files concurrently with explicit headers, deletes files
+that are gone, saves the new manifest and invalidates exactly the paths
+CloudFront may have cached: changed and deleted files, never new ones.
+Over MAX_INVALIDATION_PATHS paths it invalidates /* instead.
+
+Without a manifest (first run, or it was removed) the bucket listing is
+used: objects uploaded in one part have their MD5 as ETag, so unchanged
+files are still skipped. A file whose upload fails keeps its old manifest
+entry and is retried on the next deploy.
+
+    python tools/deploy_site.py --bucket clintecker.com --distribution E123 [--dry-run]
+"""
+
+import argparse
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+import tracing
+from s3_batch import delete_keys
+
+# Deploy state lives under a prefix the site never serves; nothing in
+# public/ may use it, and keys under it are never synced or deleted
+STATE_PREFIX = "_deploy/"
+MANIFEST_KEY = STATE_PREFIX + "manifest.json"
+# Where earlier deploys kept the manifest, readable through CloudFront;
+# read once if there is no new manifest, then deleted
+LEGACY_MANIFEST_KEY = ".deploy-manifest.json"
+UPLOAD_WORKERS = 16
+# Paths per invalidation before falling back to /* (the first 1000 paths a
+# month are free, and a wildcard counts as one)
+MAX_INVALIDATION_PATHS = 100
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# Browsers recheck pages after a minute; the CDN keeps them for a day, since
+# every deploy invalidates the pages it changes
+PAGE_CACHE = "public, max-age=60, s-maxage=86400"
+ASSET_CACHE = "public, max-age=3600, s-maxage=86400"
+
+# (pattern, Cache-Control), first match wins
+CACHE_RULES = (
+    # Gallery variants (photo_0_<source hash>_768w.jpg) and fingerprinted assets
+    (re.compile(r"_[0-9a-f]{12}_\d+w\.\w+$"), IMMUTABLE),
+    (re.compile(r"\.[0-9a-f]{32,64}\.\w+$"), IMMUTABLE),
+    (re.compile(r"\.(html|xml|json|txt)$"), PAGE_CACHE),
+)
+
+EXTRA_TYPES = {
+    ".avif": "image/avif",
+    ".webp": "image/webp",
+    ".webmanifest": "application/manifest+json",
+    ".xml": "application/xml",
+    ".json": "application/json",
+    ".js": "text/javascript",
+}
+TEXT_TYPES = ("text/", "application/json", "application/xml", "application/manifest+json")
+
+Entry = Dict[str, object]
+
+
+def content_type(path: str) -> str:
+    suffix = Path(path).suffix.lower()
+    ctype = EXTRA_TYPES.get(suffix) or mimetypes.guess_type(path)[0] or "application/octet-stream"
+    if ctype.startswith(TEXT_TYPES):
+        ctype += "; charset=utf-8"
+    return ctype
+
+
+def cache_control(path: str) -> str:
+    for pattern, value in CACHE_RULES:
+        if pattern.search(path):
+            return value
+    return ASSET_CACHE
+
+
+def scan(public_dir: Path) -> Dict[str, Entry]:
+    """Manifest entries for every file under public_dir, keyed by S3 key."""
+    entries = {}
+    for path in sorted(public_dir.rglob("*")):
+        if not path.is_file():
+            continue
+        key = path.relative_to(public_dir).as_posix()
+        if key.startswith(STATE_PREFIX):
+            raise ValueError(f"{key}: {STATE_PREFIX} is reserved for deploy state")
+        with open(path, "rb") as f:
+            md5 = hashlib.file_digest(f, "md5").hexdigest()
+        entries[key] = {
+            "md5": md5,
+            "size": path.stat().st_size,
+            "content_type": content_type(key),
+            "cache_control": cache_control(key),
+        }
+    return entries
+
+
+def load_manifest(s3, bucket: str, key: str = MANIFEST_KEY) -> Optional[Dict[str, Entry]]:
+    try:
+        obj = s3.get_object(Bucket=bucket, Key=key)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(obj["Body"].read())
+
+
+def manifest_from_listing(s3, bucket: str) -> Dict[str, Entry]:
+    """Best-effort manifest from object ETags, for the first deploy.
+
+    Headers aren't listed, so they're assumed right; multipart ETags match
+    no MD5, so those objects are uploaded again.
+    """
+    entries = {}
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket):
+        for obj in page.get("Contents", []):
+            key = obj["Key"]
+            if key.startswith(STATE_PREFIX) or key == LEGACY_MANIFEST_KEY:
+                continue
+            entries[key] = {
+                "md5": obj["ETag"].strip('"'),
+                "size": obj["Size"],
+                "content_type": content_type(key),
+                "cache_control": cache_control(key),
+            }
+    return entries
+
+
+def plan(
+    local: Dict[str, Entry], deployed: Dict[str, Entry]
+) -> Tuple[List[str], List[str], List[str]]:
+    """(new keys, changed keys, deleted keys)"""
+    new = [key for key in local if key not in deployed]
+    changed = [key for key in local if key in deployed and local[key] != deployed[key]]
+    deleted = [key for key in deployed if key not in local]
+    return new, changed, deleted
+
+
+def invalidation_paths(keys: List[str], limit: int = MAX_INVALIDATION_PATHS) -> List[str]:
+    """CloudFront paths for changed or deleted keys; ["/*"] if there are too many.
+
+    A directory's index.html is also served as the directory URL, so both
+    are invalidated.
+    """
+    paths = set()
+    for key in keys:
+        paths.add("/" + quote(key))
+        if key == "index.html":
+            paths.add("/")
+        elif key.endswith("/index.html"):
+            paths.add("/" + quote(key[: -len("index.html")]))
+    if len(paths) > limit:
+        return ["/*"]
+    return sorted(paths)
+
+
+def upload(s3, bucket: str, public_dir: Path, key: str, entry: Entry) -> bool:
+    try:
+        with tracing.span("upload", "deploy", key=key), open(public_dir / key, "rb") as f:
+            s3.put_object(
+                Bucket=bucket,
+                Key=key,
+                Body=f,
+                ContentType=entry["content_type"],
+                CacheControl=entry["cache_control"],
+            )
+        return True
+    except Exception as e:
+        print(f"Error uploading {key}: {e}")
+        return False
+
+
+def invalidate(cloudfront, distribution_id: str, paths: List[str]) -> str:
+    response = cloudfront.create_invalidation(
+        DistributionId=distribution_id,
+        InvalidationBatch={
+            "Paths": {"Quantity": len(paths), "Items": paths},
+            "CallerReference": f"deploy-{time.time_ns()}",
+        },
+    )
+    return response["Invalidation"]["Id"]
+
+
+def deploy(
+    public_dir: Path,
+    bucket: str,
+    distribution_id: Optional[str] = None,
+    s3=None,
+    cloudfront=None,
+    workers: int = UPLOAD_WORKERS,
+    dry_run: bool = False,
+) -> bool:
+    """Sync public_dir to bucket and invalidate what changed; False on any error."""
+    s3 = s3 or tracing.instrument_boto3(
+        boto3.client("s3", config=Config(max_pool_connections=workers))
+    )
+
+    with tracing.stage("scan"):
+        local = scan(public_dir)
+        deployed = load_manifest(s3, bucket)
+        legacy = False
+        if deployed is None:
+            deployed = load_manifest(s3, bucket, LEGACY_MANIFEST_KEY)
+            legacy = deployed is not None
+            if legacy:
+                print(f"Moving the manifest from {LEGACY_MANIFEST_KEY} to {MANIFEST_KEY}")
+        if deployed is None:
+            print(f"No {MANIFEST_KEY} in {bucket}; comparing against the bucket listing")
+            deployed = manifest_from_listing(s3, bucket)
+
+    new, changed, deleted = plan(local, deployed)
+    paths = invalidation_paths(changed + deleted) if changed or deleted else []
+    print(
+        f"{len(local)} files: {len(new)} new, {len(changed)} changed, "
+        f"{len(deleted)} deleted, {len(local) - len(new) - len(changed)} unchanged"
+    )
+    if dry_run:
+        for label, keys in (("upload", new + changed), ("delete", deleted)):
+            for key in keys:
+                print(f"  would {label} {key}")
+        print(f"  would invalidate {' '.join(paths) or 'nothing'}")
+        return True
+
+    ok = True
+    uploaded = []
+    with tracing.stage("upload", files=len(new) + len(changed)):
+        to_upload = new + changed
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = pool.map(
+                lambda key: upload(s3, bucket, public_dir, key, local[key]), to_upload
+            )
+            for key, succeeded in zip(to_upload, results):
+                if succeeded:
+                    uploaded.append(key)
+                else:
+                    ok = False
+
+    # Failed uploads keep their old entry so they are retried next time
+    manifest = {key: entry for key, entry in deployed.items() if key in local}
+    manifest.update({key: local[key] for key in uploaded})
+
+    with tracing.stage("delete", files=len(deleted)):
+        failed = set(delete_keys(s3, deleted, bucket)) if deleted else set()
+    if failed:
+        ok = False
+        manifest.update({key: deployed[key] for key in failed})
+
+    s3.put_object(
+        Bucket=bucket,
+        Key=MANIFEST_KEY,
+        Body=json.dumps(manifest, sort_keys=True, separators=(",", ":")).encode("utf-8"),
+        ContentType="application/json",
+        CacheControl="no-store",
+    )
+    if legacy:
+        delete_keys(s3, [LEGACY_MANIFEST_KEY], bucket)
+    print(f"Uploaded {len(uploaded)} files, deleted {len(deleted) - len(failed)}")
+
+    if paths and distribution_id:
+        cloudfront = cloudfront or tracing.instrument_boto3(boto3.client("cloudfront"))
+        with tracing.stage("invalidate", paths=len(paths)):
+            invalidation_id = invalidate(cloudfront, distribution_id, paths)
+        print(f"Invalidation {invalidation_id}: {' '.join(paths)}")
+    elif paths:
+        print("No CloudFront distribution set; skipping invalidation")
+    else:
+        print("Nothing cached has changed; no invalidation needed")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--public-dir", type=Path, default=Path("public"), help="Built site")
+    parser.add_argument(
+        "--bucket", default=os.getenv("SITE_BUCKET"), help="Site bucket (default: $SITE_BUCKET)"
+    )
+    parser.add_argument(
+        "--distribution",
+        default=os.getenv("CF_DIST_SITE"),
+        help="CloudFront distribution to invalidate (default: $CF_DIST_SITE)",
+    )
+    parser.add_argument("--workers", type=int, default=UPLOAD_WORKERS, help="Concurrent uploads")
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Print the plan without changing anything"
+    )
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure_from_args("deploy_site", args)
+
+    if not args.bucket:
+        parser.error("--bucket or SITE_BUCKET is required")
+    if not args.public_dir.is_dir():
+        parser.error(f"{args.public_dir} does not exist; build the site first")
+
+    ok = deploy(
+        args.public_dir, args.bucket, args.distribution, workers=args.workers, dry_run=args.dry_run
+    )
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
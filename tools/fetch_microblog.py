@@ -1,85 +1,142 @@
 #!/usr/bin/env python3
-"""Fetch posts and bookmarks from Micro.blog JSON feeds and convert to Hugo content."""
+"""Fetch posts and bookmarks from Micro.blog JSON feeds and convert to Hugo content.
 
-import json
+--trace records a span per feed fetch, HTTP request and page write;
+--profile profiles the fetch and write stages (see tracing.py).
+"""
+
+import argparse
+import asyncio
 import os
-import re
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional, Tuple
 
 import frontmatter
 import requests
+from requests.adapters import HTTPAdapter
 from slugify import slugify
 
+import tracing
+from content_writer import ContentEmitter
+from html_markdown import convert
+from state_store import StateStore, item_hash
+
+# Safety stop when following next_url pages back through the archive
+MAX_FEED_PAGES = 20
+
+# Concurrent file writes in the async sync mode
+RENDER_WORKERS = 8
+
 
 class MicroblogFetcher:
     """Fetches and processes Micro.blog content into Hugo markdown files."""
 
-    def __init__(self, cache_path: str = "data/cache.json"):
-        self.cache_path = Path(cache_path)
-        self.cache = self._load_cache()
+    def __init__(
+        self, state_path: str = "data/state.sqlite", cache_path: str = "data/cache.json"
+    ):
+        # Processed item ids; cache.json from older runs is migrated on first open
+        self.state = StateStore(Path(state_path), legacy_cache_path=Path(cache_path))
         self.content_dir = Path("content")
         self.posts_dir = self.content_dir / "posts"
         self.galleries_dir = self.content_dir / "galleries"
         self.links_dir = self.content_dir / "links"
+        # Skips rewriting pages whose bytes haven't changed
+        self.emitter = ContentEmitter()
 
         # Micro.blog API configuration
         self.api_base = os.getenv("MB_API_BASE", "https://micro.blog")
         self.username = os.getenv("MB_USERNAME", "")
         self.token = os.getenv("MB_APP_TOKEN", "")
 
+        # One keep-alive pool shared by the posts and bookmarks fetches
+        self.http = tracing.instrument_session(requests.Session())
+        self.http.mount("https://", HTTPAdapter(pool_connections=2, pool_maxsize=4))
+
         # Ensure directories exist
         self.posts_dir.mkdir(parents=True, exist_ok=True)
         self.galleries_dir.mkdir(parents=True, exist_ok=True)
         self.links_dir.mkdir(parents=True, exist_ok=True)
 
-    def _load_cache(self) -> Dict[str, Any]:
-        """Load cache of previously processed items."""
-        if self.cache_path.exists():
-            with open(self.cache_path, "r") as f:
-                return json.load(f)
-        return {"posts": [], "bookmarks": []}
-
-    def _save_cache(self):
-        """Save cache to disk."""
-        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
-        with open(self.cache_path, "w") as f:
-            json.dump(self.cache, f, indent=2)
-
-    def fetch_api(self, endpoint: str) -> List[Dict[str, Any]]:
-        """Fetch data from Micro.blog API with authentication."""
-        if not self.token:
-            print("Error: MB_APP_TOKEN not set")
-            return []
-
-        url = f"{self.api_base}{endpoint}"
-        headers = {"Authorization": f"Bearer {self.token}"}
-
-        try:
-            response = requests.get(url, headers=headers, timeout=30)
+    def fetch_new_items(
+        self, url: str, kind: str, headers: Optional[Dict[str, str]] = None
+    ) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, str]]]:
+        """Fetch feed items that haven't been processed yet.
+
+        Sends the ETag/Last-Modified saved from the last successful sync and
+        returns None if the server answers 304 Not Modified. Otherwise follows
+        JSON Feed next_url pages (newest first) until it reaches an item id
+        already in the state store. Returns (new items, validators); pass the
+        validators to save_validators() once the items have been processed.
+        """
+        return self._fetch_feed(
+            url,
+            headers,
+            self._stored_validators(url),
+            lambda item_id: self.state.seen(kind, item_id),
+        )
+
+    def _stored_validators(self, url: str) -> Dict[str, str]:
+        return {
+            key: self.state.get_meta(f"{key}:{url}") or ""
+            for key in ("etag", "last_modified")
+        }
+
+    def _fetch_feed(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]],
+        validators: Dict[str, str],
+        is_known: Callable[[Any], bool],
+    ) -> Optional[Tuple[List[Dict[str, Any]], Dict[str, str]]]:
+        """Network half of fetch_new_items; touches no state so it can run in a thread."""
+        with tracing.stage("fetch", url=url):
+            conditional_headers = dict(headers or {})
+            if validators.get("etag"):
+                conditional_headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                conditional_headers["If-Modified-Since"] = validators["last_modified"]
+
+            response = self.http.get(url, headers=conditional_headers, timeout=30)
+            if response.status_code == 304:
+                return None
             response.raise_for_status()
-            data = response.json()
-            return data.get("items", [])
-        except Exception as e:
-            print(f"Error fetching {endpoint}: {e}")
-            return []
+
+            validators = {
+                "etag": response.headers.get("ETag", ""),
+                "last_modified": response.headers.get("Last-Modified", ""),
+            }
+
+            items = []
+            page = response.json()
+            for _ in range(MAX_FEED_PAGES):
+                for item in page.get("items", []):
+                    if is_known(item.get("id")):
+                        return items, validators
+                    items.append(item)
+
+                next_url = page.get("next_url")
+                if not next_url:
+                    break
+                response = self.http.get(next_url, headers=headers, timeout=30)
+                response.raise_for_status()
+                page = response.json()
+
+            return items, validators
+
+    def save_validators(self, url: str, validators: Dict[str, str]):
+        """Remember a feed's cache validators for the next conditional request."""
+        for key, value in validators.items():
+            if value:
+                self.state.set_meta(f"{key}:{url}", value)
 
     def _strip_html(self, html: str) -> str:
-        """Simple HTML tag removal."""
-        return re.sub(r"<[^>]+>", "", html)
+        """Plain text of an HTML fragment."""
+        return convert(html).text
 
     def _html_to_markdown(self, html: str) -> str:
-        """Convert basic HTML to Markdown."""
-        # This is a simple conversion; you may want to use a library like html2text
-        text = html
-        # Convert links
-        text = re.sub(r'<a\s+href="([^"]+)"[^>]*>([^<]+)</a>', r"[\2](\1)", text)
-        # Convert images
-        text = re.sub(r'<img\s+src="([^"]+)"[^>]*alt="([^"]*)"[^>]*>', r"![\2](\1)", text)
-        # Remove remaining tags
-        text = re.sub(r"<[^>]+>", "", text)
-        return text.strip()
+        """Convert HTML to Markdown."""
+        return convert(html).markdown
 
     def _extract_photos(self, item: Dict[str, Any]) -> List[Dict[str, str]]:
         """Extract photo attachments from an item."""
@@ -96,22 +153,25 @@ class MicroblogFetcher:
 
     def _is_photo_post(self, item: Dict[str, Any]) -> bool:
         """Determine if an item is primarily a photo post."""
-        photos = self._extract_photos(item)
-        content_html = item.get("content_html", "")
-        content_text = self._strip_html(content_html).strip()
-
+        if not self._extract_photos(item):
+            return False
         # Photo post if it has photos and minimal text
-        return len(photos) > 0 and len(content_text) < 200
+        return convert(item.get("content_html", "")).text_length < 200
 
     def _create_post(self, item: Dict[str, Any]):
         """Create a Hugo post from a Micro.blog item."""
         item_id = item.get("id")
-        if item_id in self.cache["posts"]:
+        if self.state.seen("posts", item_id):
             return
 
+        if self._write_post(item):
+            self.state.mark("posts", item_id, item_hash(item))
+
+    def _write_post(self, item: Dict[str, Any]) -> bool:
+        """Write a post's markdown file; False if the item has no date."""
         date_str = item.get("date_published", "")
         if not date_str:
-            return
+            return False
 
         date = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
         title = item.get("title", "")
@@ -149,21 +209,24 @@ class MicroblogFetcher:
         # Write to file
         filename = f"{date.strftime('%Y-%m-%d')}-{slug}.md"
         filepath = self.posts_dir / filename
-        with open(filepath, "w") as f:
-            f.write(frontmatter.dumps(post))
-
-        print(f"Created post: {filepath}")
-        self.cache["posts"].append(item_id)
+        if self.emitter.write_text(filepath, frontmatter.dumps(post)):
+            print(f"Created post: {filepath}")
+        return True
 
     def _create_gallery(self, item: Dict[str, Any]):
         """Create a Hugo gallery page from a photo post."""
         item_id = item.get("id")
-        if item_id in self.cache["posts"]:
+        if self.state.seen("posts", item_id):
             return
 
+        if self._write_gallery(item):
+            self.state.mark("posts", item_id, item_hash(item))
+
+    def _write_gallery(self, item: Dict[str, Any]) -> bool:
+        """Write a gallery page's markdown file; False if the item has no date."""
         date_str = item.get("date_published", "")
         if not date_str:
-            return
+            return False
 
         date = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
         title = item.get("title", "")
@@ -198,23 +261,19 @@ class MicroblogFetcher:
         # Write to file
         filename = f"{date.strftime('%Y-%m-%d')}-{slug}.md"
         filepath = self.galleries_dir / filename
-        with open(filepath, "w") as f:
-            f.write(frontmatter.dumps(gallery))
-
-        print(f"Created gallery: {filepath}")
-        self.cache["posts"].append(item_id)
+        if self.emitter.write_text(filepath, frontmatter.dumps(gallery)):
+            print(f"Created gallery: {filepath}")
+        return True
 
-    def _create_link(self, item: Dict[str, Any]):
-        """Add a bookmark to the daily links file."""
-        item_id = item.get("id")
-        if item_id in self.cache["bookmarks"]:
-            return
-
-        date_str = item.get("date_published", "")
-        if not date_str:
-            return
+    def _write_item(self, item: Dict[str, Any]) -> bool:
+        """Write a feed item as a gallery or a post, whichever it is."""
+        with tracing.stage("write", id=item.get("id")):
+            if self._is_photo_post(item):
+                return self._write_gallery(item)
+            return self._write_post(item)
 
-        date = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
+    def _link_entry(self, item: Dict[str, Any]) -> str:
+        """Render a bookmark as a daily links section."""
         url = item.get("url", "")
         title = item.get("title", "") or "Link"
         content_html = item.get("content_html", "")
@@ -233,30 +292,83 @@ class MicroblogFetcher:
             if content_plain:
                 title = content_plain.split("\n")[0][:60]
 
-        # Daily links file
-        filename = f"{date.strftime('%Y-%m-%d')}.md"
-        filepath = self.links_dir / filename
-
-        # Load existing or create new
-        if filepath.exists():
-            with open(filepath, "r") as f:
-                links_page = frontmatter.load(f)
-        else:
-            links_page = frontmatter.Post("")
-            links_page["title"] = f"Links for {date.strftime('%B %d, %Y')}"
-            links_page["date"] = date.replace(hour=0, minute=0, second=0).isoformat()
-            links_page["type"] = "links"
+        return f"\n\n### [{title}]({url})\n\n{content}"
 
-        # Append link
-        link_entry = f"\n\n### [{title}]({url})\n\n{content}"
-        links_page.content += link_entry
+    def _group_links(
+        self, items: List[Dict[str, Any]], is_known: Callable[[Any], bool]
+    ) -> Dict[str, List[Tuple[datetime, Dict[str, Any]]]]:
+        """Group new bookmarks by day, oldest first, dropping known and repeated ids."""
+        by_day: Dict[str, List[Tuple[datetime, Dict[str, Any]]]] = {}
+        batch_ids = set()
+        for item in items:
+            item_id = item.get("id")
+            if item_id in batch_ids or is_known(item_id):
+                continue
+            date_str = item.get("date_published", "")
+            if not date_str:
+                continue
+            batch_ids.add(item_id)
+            date = datetime.fromisoformat(date_str.replace("Z", "+00:00"))
+            by_day.setdefault(date.strftime("%Y-%m-%d"), []).append((date, item))
+
+        for day_items in by_day.values():
+            day_items.sort(key=lambda pair: pair[0])
+        return dict(sorted(by_day.items()))
+
+    def _write_links_day(self, day: str, day_items: List[Tuple[datetime, Dict[str, Any]]]):
+        """Append a day's bookmarks to its links page with a single write.
+
+        Links whose heading is already on the page are skipped.
+        """
+        with tracing.stage("write", day=day):
+            first_date = day_items[0][0]
+
+            # Daily links file
+            filepath = self.links_dir / f"{day}.md"
+
+            # Load existing or create new
+            if filepath.exists():
+                with open(filepath, "r") as f:
+                    links_page = frontmatter.load(f)
+            else:
+                links_page = frontmatter.Post("")
+                links_page["title"] = f"Links for {first_date.strftime('%B %d, %Y')}"
+                links_page["date"] = first_date.replace(hour=0, minute=0, second=0).isoformat()
+                links_page["type"] = "links"
+
+            # Append links
+            entries = []
+            for _, item in day_items:
+                entry = self._link_entry(item)
+                heading = entry.strip().split("\n", 1)[0]
+                if heading in links_page.content or any(heading in e for e in entries):
+                    continue
+                entries.append(entry)
+            if entries:
+                links_page.content += "".join(entries)
+                self.emitter.write_text(filepath, frontmatter.dumps(links_page))
+                print(f"Added {len(entries)} links to: {filepath}")
+
+    def _create_links(self, items: List[Dict[str, Any]]):
+        """Add bookmarks to their daily links files, writing each file once."""
+        by_day = self._group_links(items, lambda item_id: self.state.seen("bookmarks", item_id))
+        for day, day_items in by_day.items():
+            self._write_links_day(day, day_items)
+            for _, item in day_items:
+                self.state.mark("bookmarks", item.get("id"), item_hash(item))
+
+    @property
+    def feed_url(self) -> str:
+        # Use the user's hosted feed.json for actual content
+        return f"https://{self.username}.micro.blog/feed.json"
 
-        # Write to file
-        with open(filepath, "w") as f:
-            f.write(frontmatter.dumps(links_page))
+    @property
+    def bookmarks_url(self) -> str:
+        return f"{self.api_base}/posts/bookmarks"
 
-        print(f"Added link to: {filepath}")
-        self.cache["bookmarks"].append(item_id)
+    @property
+    def bookmarks_headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {self.token}"}
 
     def process_posts(self):
         """Process posts from Micro.blog hosted feed."""
@@ -264,50 +376,177 @@ class MicroblogFetcher:
             print("Error: MB_USERNAME not set")
             return
 
-        # Use the user's hosted feed.json for actual content
-        feed_url = f"https://{self.username}.micro.blog/feed.json"
+        feed_url = self.feed_url
         try:
-            response = requests.get(feed_url, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-            items = data.get("items", [])
+            fetched = self.fetch_new_items(feed_url, "posts")
         except Exception as e:
             print(f"Error fetching feed from {feed_url}: {e}")
             return
 
-        print(f"Found {len(items)} posts")
+        if fetched is None:
+            print("Feed not modified since last sync")
+            return
+        items, validators = fetched
+
+        print(f"Found {len(items)} new posts")
 
         for item in items:
-            if self._is_photo_post(item):
-                self._create_gallery(item)
-            else:
-                self._create_post(item)
+            with tracing.stage("write", id=item.get("id")):
+                if self._is_photo_post(item):
+                    self._create_gallery(item)
+                else:
+                    self._create_post(item)
+
+        self.save_validators(feed_url, validators)
 
     def process_bookmarks(self):
         """Process bookmarks from Micro.blog API."""
-        endpoint = "/posts/bookmarks"
-        items = self.fetch_api(endpoint)
-        print(f"Found {len(items)} bookmarks")
+        if not self.token:
+            print("Error: MB_APP_TOKEN not set")
+            return
 
-        for item in items:
-            self._create_link(item)
+        url = self.bookmarks_url
+        headers = self.bookmarks_headers
+        try:
+            fetched = self.fetch_new_items(url, "bookmarks", headers=headers)
+        except Exception as e:
+            print(f"Error fetching /posts/bookmarks: {e}")
+            return
 
-    def run(self):
+        if fetched is None:
+            print("Bookmarks not modified since last sync")
+            return
+        items, validators = fetched
+
+        print(f"Found {len(items)} new bookmarks")
+
+        self._create_links(items)
+
+        self.save_validators(url, validators)
+
+    async def sync(self):
+        """Fetch posts and bookmarks concurrently, then write them in parallel.
+
+        Network requests and file writes run in worker threads; the state
+        store is only touched on the event loop thread. Nothing is recorded
+        as processed, and no validators are saved, unless every write
+        succeeds, so a failed run is simply repeated next time.
+        """
+        # Snapshot processed ids so worker threads never touch sqlite
+        known_ids = {kind: self.state.ids(kind) for kind in ("posts", "bookmarks")}
+        sources = {
+            "posts": (self.feed_url, None),
+            "bookmarks": (self.bookmarks_url, self.bookmarks_headers),
+        }
+        known = {
+            kind: (lambda item_id, ids=ids: str(item_id) in ids)
+            for kind, ids in known_ids.items()
+        }
+
+        print(f"Fetching posts and bookmarks for @{self.username}")
+        fetches = [
+            asyncio.to_thread(
+                self._fetch_feed, url, headers, self._stored_validators(url), known[kind]
+            )
+            for kind, (url, headers) in sources.items()
+        ]
+        results = await asyncio.gather(*fetches, return_exceptions=True)
+
+        # (write callable, [(kind, item)] recorded once it succeeds)
+        jobs: List[Tuple[Callable[[], Any], List[Tuple[str, Dict[str, Any]]]]] = []
+        fetched_validators = {}
+        for (kind, (url, _)), result in zip(sources.items(), results):
+            if isinstance(result, Exception):
+                print(f"Error fetching {url}: {result}")
+                continue
+            if result is None:
+                print(f"{kind.capitalize()} not modified since last sync")
+                continue
+            items, validators = result
+            fetched_validators[url] = validators
+            print(f"Found {len(items)} new {kind}")
+
+            if kind == "posts":
+                batch_ids = set()
+                for item in items:
+                    item_id = item.get("id")
+                    if item_id in batch_ids or known["posts"](item_id):
+                        continue
+                    batch_ids.add(item_id)
+                    jobs.append((lambda item=item: self._write_item(item), [("posts", item)]))
+            else:
+                by_day = self._group_links(items, known["bookmarks"])
+                for day, day_items in by_day.items():
+                    jobs.append(
+                        (
+                            lambda day=day, day_items=day_items: self._write_links_day(day, day_items),
+                            [("bookmarks", item) for _, item in day_items],
+                        )
+                    )
+
+        slots = asyncio.Semaphore(RENDER_WORKERS)
+
+        async def render(write):
+            async with slots:
+                return await asyncio.to_thread(write)
+
+        outcomes = await asyncio.gather(
+            *(render(write) for write, _ in jobs), return_exceptions=True
+        )
+        errors = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        if errors:
+            for error in errors:
+                print(f"Error writing content: {error}")
+            print(f"{len(errors)} of {len(jobs)} writes failed; state not updated")
+            return
+
+        processed = [
+            (kind, item.get("id"), item_hash(item))
+            for (_, marks), outcome in zip(jobs, outcomes)
+            # Posts without a date return False and stay unrecorded, as in process_posts
+            if outcome is not False
+            for kind, item in marks
+        ]
+        self.state.mark_many(processed)
+        for url, validators in fetched_validators.items():
+            self.save_validators(url, validators)
+
+    def run(self, sequential: bool = False):
         """Run the fetcher with environment variables."""
         if not self.username or not self.token:
             print("Error: MB_USERNAME and MB_APP_TOKEN must be set")
             return
 
-        print(f"Processing posts for @{self.username}")
-        self.process_posts()
+        if sequential:
+            print(f"Processing posts for @{self.username}")
+            self.process_posts()
 
-        print(f"Processing bookmarks for @{self.username}")
-        self.process_bookmarks()
+            print(f"Processing bookmarks for @{self.username}")
+            self.process_bookmarks()
+        else:
+            asyncio.run(self.sync())
+
+        print(
+            f"Done! {self.state.count('posts')} posts and "
+            f"{self.state.count('bookmarks')} bookmarks recorded in {self.state.path} "
+            f"({self.emitter.summary()})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="Fetch and write posts, then bookmarks, one item at a time",
+    )
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure_from_args("fetch_microblog", args)
 
-        self._save_cache()
-        print("Done!")
+    fetcher = MicroblogFetcher()
+    fetcher.run(sequential=args.sequential)
 
 
 if __name__ == "__main__":
-    fetcher = MicroblogFetcher()
-    fetcher.run()
+    main()
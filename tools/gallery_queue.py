@@ -0,0 +1,85 @@
+"""Notification queues for the push-driven pending-gallery consumer.
+
+gallery-service sends a message to SQS after writing each manifest (S3
+event notifications to the same queue work too). Messages are only wake-up
+calls; the consumer still lists pending-galleries/ to find the work, so a
+lost or duplicate message costs nothing but latency.
+
+LocalQueue has the same interface in memory, for tests and local runs.
+"""
+
+import queue
+from typing import List, NamedTuple
+
+import boto3
+
+
+class Message(NamedTuple):
+    body: str
+    receipt: str
+
+
+class SQSQueue:
+    """Long-polling SQS queue."""
+
+    def __init__(self, queue_url: str, client=None):
+        self.queue_url = queue_url
+        self.client = client or boto3.client("sqs")
+
+    def send(self, body: str):
+        self.client.send_message(QueueUrl=self.queue_url, MessageBody=body)
+
+    def receive(self, wait_seconds: float) -> List[Message]:
+        """Up to 10 messages, waiting up to wait_seconds (SQS caps it at 20)."""
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=10,
+            WaitTimeSeconds=max(0, min(int(wait_seconds), 20)),
+        )
+        return [
+            Message(m["Body"], m["ReceiptHandle"]) for m in response.get("Messages", [])
+        ]
+
+    def delete(self, messages: List[Message]):
+        """Acknowledge messages so they aren't redelivered."""
+        for start in range(0, len(messages), 10):
+            batch = messages[start:start + 10]
+            self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[
+                    {"Id": str(i), "ReceiptHandle": m.receipt} for i, m in enumerate(batch)
+                ],
+            )
+
+
+class LocalQueue:
+    """In-process stand-in for SQSQueue.
+
+    Received messages are handed out once; messages that are never deleted
+    are simply dropped, since there is no visibility timeout to expire.
+    """
+
+    def __init__(self):
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._next_receipt = 0
+        self.deleted: List[Message] = []
+
+    def send(self, body: str):
+        self._queue.put(body)
+
+    def receive(self, wait_seconds: float) -> List[Message]:
+        messages = []
+        timeout = max(wait_seconds, 0)
+        while len(messages) < 10:
+            try:
+                body = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._next_receipt += 1
+            messages.append(Message(body, str(self._next_receipt)))
+            # Like SQS, return as soon as something arrives; take what's ready
+            timeout = 0
+        return messages
+
+    def delete(self, messages: List[Message]):
+        self.deleted.extend(messages)
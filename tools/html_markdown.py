@@ -0,0 +1,282 @@
+"""Single-pass HTML to Markdown conversion for Micro.blog content.
+
+Micro.blog's content_html is small, mostly well-formed HTML: paragraphs,
+links, images, emphasis, lists, blockquotes and code. convert() walks it
+once with html.parser and returns the Markdown, the plain text and the
+images together, so callers that need all three don't parse the same
+post several times.
+
+Most posts are plain tags with double-quoted attributes. Those are split
+with one compiled regex and fed to the same handlers, which is several
+times faster than HTMLParser's tokenizer; anything else (comments, bare or
+single-quoted attributes, script and style) goes through HTMLParser.
+
+This is still slower than the three regex substitutions it replaced:
+tools/bench_html_markdown.py measures about 4-5x on short posts (roughly
+50us against 12us per item) and about 7x on long, list-heavy fragments.
+The regexes dropped lists, quotes and nested markup, and a feed of a few
+hundred items still converts in a few milliseconds, each item once, so
+correctness won.
+"""
+
+import html
+import re
+from functools import lru_cache
+from html.parser import HTMLParser
+from typing import List, NamedTuple, Optional, Tuple
+
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "figure", "figcaption", "header", "footer",
+    "table", "tr", "dl", "dt", "dd",
+}
+HEADING_LEVELS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+EMPHASIS_MARKERS = {"strong": "**", "b": "**", "em": "*", "i": "*", "del": "~~", "s": "~~"}
+SKIPPED_TAGS = {"script", "style", "template"}
+
+WHITESPACE_RE = re.compile(r"\s+")
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+TRAILING_SPACE_RE = re.compile(r"[ \t]+\n")
+
+# Plain start tags with double-quoted attributes, and bare end tags;
+# script and style are left to HTMLParser, which reads them as raw text
+_START_TAG = r'<(?!(?i:script|style)\b)[a-zA-Z][a-zA-Z0-9]*(?:\s+[a-zA-Z][-a-zA-Z0-9_:]*="[^"<>]*")*\s*/?>'
+_END_TAG = r"</[a-zA-Z][a-zA-Z0-9]*\s*>"
+SIMPLE_FRAGMENT_RE = re.compile(rf"[^<]*(?:(?:{_START_TAG}|{_END_TAG})[^<]*)*")
+# (closing slash, name, attributes, self-closing slash) of a tag in a simple fragment
+SIMPLE_TAG_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9]*)([^>]*?)\s*(/?)>")
+SIMPLE_ATTR_RE = re.compile(r'([a-zA-Z][-a-zA-Z0-9_:]*)="([^"]*)"')
+
+
+class ConvertedHTML(NamedTuple):
+    """Markdown, plain text and (url, alt) images for one HTML fragment."""
+
+    markdown: str
+    text: str
+    images: Tuple[Tuple[str, str], ...]
+
+    @property
+    def text_length(self) -> int:
+        return len(self.text)
+
+
+class _MarkdownBuilder(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        # Output buffers; links and blockquotes push a new one and fold it
+        # into the parent when they close. buffer_tags names each one's owner
+        self.buffers: List[List[str]] = [[]]
+        self.buffer_tags: List[Optional[str]] = [None]
+        self.text: List[str] = []
+        self.images: List[Tuple[str, str]] = []
+        self.lists: List[List] = []  # [tag, next ordinal]
+        self.link_hrefs: List[Optional[str]] = []
+        self.pre_depth = 0
+        self.skip_depth = 0
+
+    @property
+    def out(self) -> List[str]:
+        return self.buffers[-1]
+
+    def _block_break(self):
+        self.out.append("\n\n")
+        self.text.append("\n")
+
+    def _line_break(self):
+        self.out.append("\n")
+        self.text.append("\n")
+
+    def _open_buffer(self, tag: str):
+        self.buffers.append([])
+        self.buffer_tags.append(tag)
+
+    def _close_buffer(self, tag: str) -> Optional[str]:
+        """Contents of the innermost buffer tag opened, or None if there is none.
+
+        Buffers opened inside it and left unclosed (misnested tags) are
+        folded into it as they are.
+        """
+        if tag not in self.buffer_tags:
+            return None
+        while self.buffer_tags[-1] != tag:
+            self.buffer_tags.pop()
+            inner = self.buffers.pop()
+            self.out.extend(inner)
+        self.buffer_tags.pop()
+        return "".join(self.buffers.pop())
+
+    def _at_line_start(self) -> bool:
+        for piece in reversed(self.out):
+            if piece:
+                return piece.endswith("\n")
+        return True
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth += 1
+            return
+        if self.skip_depth:
+            return
+        attrs = dict(attrs)
+
+        if tag in BLOCK_TAGS:
+            self._block_break()
+        elif tag in HEADING_LEVELS:
+            self._block_break()
+            self.out.append("#" * HEADING_LEVELS[tag] + " ")
+        elif tag == "br":
+            self._line_break()
+        elif tag == "hr":
+            self._block_break()
+            self.out.append("---")
+            self._block_break()
+        elif tag in EMPHASIS_MARKERS:
+            self.out.append(EMPHASIS_MARKERS[tag])
+        elif tag == "code" and not self.pre_depth:
+            self.out.append("`")
+        elif tag == "pre":
+            self._block_break()
+            self.out.append("```\n")
+            self.pre_depth += 1
+        elif tag == "blockquote":
+            self._block_break()
+            self._open_buffer("blockquote")
+        elif tag in ("ul", "ol"):
+            if not self.lists:
+                self._block_break()
+            self.lists.append([tag, 1])
+        elif tag == "li":
+            indent = "  " * max(len(self.lists) - 1, 0)
+            if self.lists and self.lists[-1][0] == "ol":
+                marker = f"{self.lists[-1][1]}. "
+                self.lists[-1][1] += 1
+            else:
+                marker = "- "
+            self.out.append(f"\n{indent}{marker}")
+            self.text.append("\n")
+        elif tag == "a":
+            # Nested anchors are invalid HTML; only the outermost becomes a link
+            href = attrs.get("href") if not self.link_hrefs else None
+            self.link_hrefs.append(href)
+            if href:
+                self._open_buffer("a")
+        elif tag == "img":
+            src = attrs.get("src") or ""
+            alt = attrs.get("alt") or ""
+            if src:
+                self.images.append((src, alt))
+                self.out.append(f"![{alt}]({src})")
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in ("br", "hr", "img"):
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self.skip_depth = max(self.skip_depth - 1, 0)
+            return
+        if self.skip_depth:
+            return
+
+        if tag in BLOCK_TAGS or tag in HEADING_LEVELS:
+            self._block_break()
+        elif tag in EMPHASIS_MARKERS:
+            self.out.append(EMPHASIS_MARKERS[tag])
+        elif tag == "code" and not self.pre_depth:
+            self.out.append("`")
+        elif tag == "pre" and self.pre_depth:
+            self.pre_depth -= 1
+            self.out.append("\n```")
+            self._block_break()
+        elif tag == "blockquote" and "blockquote" in self.buffer_tags:
+            quoted = _tidy(self._close_buffer("blockquote"))
+            self.out.append("\n".join(f"> {line}".rstrip() for line in quoted.split("\n")))
+            self._block_break()
+        elif tag in ("ul", "ol") and self.lists:
+            self.lists.pop()
+            if not self.lists:
+                self._block_break()
+        elif tag == "a" and self.link_hrefs:
+            href = self.link_hrefs.pop()
+            label = self._close_buffer("a") if href else None
+            if label is not None:
+                label = label.strip()
+                self.out.append(f"[{label or href}]({href})")
+
+    def handle_data(self, data):
+        if self.skip_depth:
+            return
+        if not self.pre_depth:
+            data = WHITESPACE_RE.sub(" ", data)
+            if self._at_line_start():
+                data = data.lstrip()
+            if not data:
+                return
+            # Keep literal angle brackets from being read back as raw HTML
+            self.out.append(data.replace("<", "&lt;"))
+        else:
+            self.out.append(data)
+        self.text.append(data)
+
+    def result(self) -> ConvertedHTML:
+        # Fold anything left open by unclosed tags back into the document
+        while len(self.buffers) > 1:
+            inner = self.buffers.pop()
+            self.out.extend(inner)
+        markdown = _tidy("".join(self.out))
+        text = "\n".join(
+            line.strip() for line in "".join(self.text).split("\n") if line.strip()
+        )
+        return ConvertedHTML(markdown, text, tuple(self.images))
+
+
+def _feed_simple(builder: _MarkdownBuilder, fragment: str):
+    """Make the calls HTMLParser would for a fragment SIMPLE_FRAGMENT_RE matched.
+
+    Names are lowercased, text and attribute values unescaped, and each run
+    of text is one handle_data call.
+    """
+    position = 0
+    for match in SIMPLE_TAG_RE.finditer(fragment):
+        if match.start() > position:
+            builder.handle_data(html.unescape(fragment[position:match.start()]))
+        closing, name, attrs, self_closing = match.groups()
+        name = name.lower()
+        if closing:
+            builder.handle_endtag(name)
+        else:
+            attrs = [
+                (attr.lower(), html.unescape(value))
+                for attr, value in SIMPLE_ATTR_RE.findall(attrs)
+            ] if attrs else []
+            if self_closing:
+                builder.handle_startendtag(name, attrs)
+            else:
+                builder.handle_starttag(name, attrs)
+        position = match.end()
+    if position < len(fragment):
+        builder.handle_data(html.unescape(fragment[position:]))
+
+
+def _tidy(markdown: str) -> str:
+    markdown = TRAILING_SPACE_RE.sub("\n", markdown)
+    return BLANK_LINES_RE.sub("\n\n", markdown).strip()
+
+
+@lru_cache(maxsize=256)
+def convert(fragment: str) -> ConvertedHTML:
+    """Convert an HTML fragment to Markdown, plain text and images in one pass.
+
+    Slower than regex stripping (see the module docstring); results are
+    cached so every caller working on the same item shares one conversion.
+    """
+    if "<" not in fragment and "&" not in fragment:
+        text = WHITESPACE_RE.sub(" ", fragment).strip()
+        return ConvertedHTML(text, text, ())
+    builder = _MarkdownBuilder()
+    if SIMPLE_FRAGMENT_RE.fullmatch(fragment):
+        _feed_simple(builder, fragment)
+    else:
+        builder.feed(fragment)
+        builder.close()
+    return builder.result()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""Run the content build stages as a dependency graph.
+
+    fetch ──▶ photos
+    pending
+
+fetch (MicroblogFetcher.run) and pending (process_pending_galleries) share
+no inputs, so they run at the same time; photos
+(PhotoProcessor.process_all_galleries) starts as soon as fetch has written
+the gallery pages it reads. A stage whose dependency failed is not run.
+A stage that returns False ran but left work undone (photos, when a
+gallery failed): it counts as "partial", doesn't block its dependents and
+isn't fingerprinted, so it runs again next time.
+
+Stages with local inputs are fingerprinted: the SHA-256 of their input
+and output files is recorded in the state store after a successful run,
+and the stage is skipped while both still match (--force runs everything).
+fetch and pending read remote sources and always run; they already skip
+unchanged feeds (conditional GET) and empty listings themselves.
+
+Ends with each stage's timing and the critical path, the chain of
+dependent stages that set the total build time.
+"""
+
+import argparse
+import hashlib
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import tracing
+from fetch_microblog import MicroblogFetcher
+from process_pending_galleries import process_pending_galleries
+from process_photos import GALLERY_DATA_PATH, PhotoProcessor
+from state_store import StateStore
+
+TOOLS_DIR = Path(__file__).resolve().parent
+
+
+@dataclass
+class Stage:
+    name: str
+    # Returns False if it left work for the next run
+    run: Callable[[argparse.Namespace], Optional[bool]]
+    needs: Tuple[str, ...] = ()
+    # Globs (relative to the working directory, or absolute) hashed into the
+    # fingerprint; no inputs means the stage always runs
+    inputs: Tuple[str, ...] = ()
+    outputs: Tuple[str, ...] = ()
+
+
+@dataclass
+class Result:
+    status: str = "pending"  # ran, partial, skipped, failed or blocked
+    start: float = 0.0
+    end: float = 0.0
+    error: Optional[str] = None
+    # Longest chain of stages ending here: (seconds, stage names)
+    path: Tuple[float, List[str]] = field(default_factory=lambda: (0.0, []))
+
+    @property
+    def seconds(self) -> float:
+        return self.end - self.start
+
+
+def run_fetch(args: argparse.Namespace):
+    MicroblogFetcher().run(sequential=args.sequential)
+
+
+def run_pending(args: argparse.Namespace):
+    process_pending_galleries()
+
+
+def run_photos(args: argparse.Namespace):
+    processor = PhotoProcessor(jobs=args.jobs)
+    try:
+        # Failed galleries keep their source_photos for the next run
+        return processor.process_all_galleries() == 0
+    finally:
+        processor.close()
+
+
+STAGES = (
+    Stage("fetch", run_fetch),
+    Stage("pending", run_pending),
+    Stage(
+        "photos",
+        run_photos,
+        needs=("fetch",),
+        inputs=(
+            "content/galleries/*.md",
+            str(TOOLS_DIR / "process_photos.py"),
+            str(TOOLS_DIR.parent / "gallery-service" / "imaging.py"),
+        ),
+        outputs=(str(GALLERY_DATA_PATH), "static/media/galleries/*/manifest.json"),
+    ),
+)
+
+
+def _expand(patterns: Iterable[str]) -> List[Path]:
+    paths = set()
+    for pattern in patterns:
+        path = Path(pattern)
+        if path.is_absolute():
+            paths.update(Path(path.anchor).glob(str(path.relative_to(path.anchor))))
+        else:
+            paths.update(Path().glob(pattern))
+    return sorted(p for p in paths if p.is_file())
+
+
+def fingerprint(stage: Stage) -> Optional[str]:
+    """SHA-256 over the names and contents of a stage's inputs and outputs."""
+    if not stage.inputs:
+        return None
+    digest = hashlib.sha256()
+    for label, patterns in (("in", stage.inputs), ("out", stage.outputs)):
+        for path in _expand(patterns):
+            digest.update(f"{label}:{path}\0".encode("utf-8"))
+            with open(path, "rb") as f:
+                digest.update(hashlib.file_digest(f, "sha256").digest())
+    return digest.hexdigest()
+
+
+def _validate(stages: Iterable[Stage]):
+    names = set()
+    for stage in stages:
+        missing = [need for need in stage.needs if need not in names]
+        if missing:
+            raise ValueError(f"{stage.name} needs {', '.join(missing)}, which must come first")
+        names.add(stage.name)
+
+
+def run_pipeline(
+    args: argparse.Namespace,
+    stages: Tuple[Stage, ...] = STAGES,
+    state: Optional[StateStore] = None,
+    force: bool = False,
+) -> Dict[str, Result]:
+    """Run every stage once its dependencies have succeeded.
+
+    Fingerprints are read and written here, on the calling thread; stages
+    themselves run in worker threads.
+    """
+    _validate(stages)
+    state = state or StateStore()
+    results = {stage.name: Result() for stage in stages}
+    started = time.perf_counter()
+
+    def execute(stage: Stage, previous: Optional[str]) -> Tuple[str, Optional[str]]:
+        """Run a stage; returns its status and the fingerprint to record."""
+        with tracing.span(stage.name, "pipeline"):
+            if previous is not None and not force and fingerprint(stage) == previous:
+                return "skipped", None
+            if stage.run(args) is False:
+                return "partial", None
+            return "ran", fingerprint(stage)
+
+    running: Dict[Future, Stage] = {}
+    with ThreadPoolExecutor(max_workers=len(stages), thread_name_prefix="stage") as pool:
+        while True:
+            for stage in stages:
+                result = results[stage.name]
+                if result.status != "pending":
+                    continue
+                needs = [results[need] for need in stage.needs]
+                if any(need.status in ("failed", "blocked") for need in needs):
+                    result.status = "blocked"
+                    continue
+                if all(need.status in ("ran", "partial", "skipped") for need in needs):
+                    result.status = "running"
+                    result.start = time.perf_counter() - started
+                    previous = state.get_meta(f"pipeline:{stage.name}")
+                    print(f"[pipeline] starting {stage.name}")
+                    running[pool.submit(execute, stage, previous)] = stage
+
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                result = results[stage.name]
+                result.end = time.perf_counter() - started
+                try:
+                    result.status, new_fingerprint = future.result()
+                except Exception as e:
+                    result.status, result.error = "failed", str(e)
+                    print(f"[pipeline] {stage.name} failed: {e}")
+                    continue
+                if new_fingerprint:
+                    state.set_meta(f"pipeline:{stage.name}", new_fingerprint)
+                print(f"[pipeline] {stage.name} {result.status} in {result.seconds:.1f}s")
+
+    # Critical path: the most expensive chain of dependencies, in stage order
+    for stage in stages:
+        result = results[stage.name]
+        upstream = max(
+            (results[need].path for need in stage.needs), key=lambda path: path[0], default=(0.0, [])
+        )
+        result.path = (upstream[0] + result.seconds, upstream[1] + [stage.name])
+    return results
+
+
+def summarize(results: Dict[str, Result]) -> str:
+    lines = [f"{'stage':<10} {'status':<8} {'start':>7} {'time':>7}"]
+    for name, result in results.items():
+        lines.append(
+            f"{name:<10} {result.status:<8} {result.start:6.1f}s {result.seconds:6.1f}s"
+            + (f"  {result.error}" if result.error else "")
+        )
+    wall = max((result.end for result in results.values()), default=0.0)
+    busy = sum(result.seconds for result in results.values())
+    seconds, chain = max((result.path for result in results.values()), key=lambda path: path[0])
+    lines.append(
+        f"Critical path: {' -> '.join(chain)} ({seconds:.1f}s); "
+        f"wall {wall:.1f}s for {busy:.1f}s of stage time"
+    )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--force", action="store_true", help="Run every stage, ignoring fingerprints")
+    parser.add_argument(
+        "--sequential",
+        action="store_true",
+        help="Have the fetch stage fetch and write posts, then bookmarks, one item at a time",
+    )
+    parser.add_argument("--jobs", "-j", type=int, help="Encode processes for the photos stage")
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure_from_args("pipeline", args)
+
+    results = run_pipeline(args, force=args.force)
+    print()
+    print(summarize(results))
+    if any(result.status in ("failed", "blocked") for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
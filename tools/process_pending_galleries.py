@@ -3,74 +3,251 @@
 
 Checks s3://i.clintecker.com/pending-galleries/ for new JSON manifests,
 creates gallery markdown files, and removes processed manifests.
+
+Every page of the listing is read, manifests are downloaded concurrently,
+and keys are deleted in batches only once their markdown is on disk. The
+S3 client, bucket, prefix and output directory can all be passed in, so
+the consumer runs against a local stand-in such as moto.
+
+With --watch it runs continuously instead: it waits on the queue that
+gallery-service notifies after writing a manifest, folds a burst of
+uploads into one batch, processes it and runs a rebuild command.
+
+--trace and --profile record spans and cProfile output (see tracing.py).
 """
 
+import argparse
 import json
 import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 import boto3
 import frontmatter
-
-
-def process_pending_galleries():
-    """Check S3 for pending galleries and create markdown files"""
-    s3 = boto3.client('s3')
-    bucket = 'i.clintecker.com'
-    prefix = 'pending-galleries/'
-
-    # List pending manifests
-    response = s3.list_objects_v2(Bucket=bucket, Prefix=prefix)
-
-    if 'Contents' not in response:
+from botocore.config import Config
+
+import tracing
+from content_writer import ContentEmitter
+from gallery_queue import SQSQueue
+from s3_batch import delete_keys
+
+BUCKET = 'i.clintecker.com'
+PREFIX = 'pending-galleries/'
+CONTENT_DIR = Path('content/galleries')
+
+# Concurrent manifest downloads (and connections in the client's pool)
+FETCH_WORKERS = 8
+
+# Watch mode: long-poll length, how long the queue must stay quiet before a
+# burst is processed, and the longest a burst may keep the batch open
+POLL_SECONDS = 20
+DEBOUNCE_SECONDS = 5
+MAX_BATCH_SECONDS = 30
+
+
+def make_s3_client():
+    """S3 client with a connection pool sized for the download workers"""
+    return tracing.instrument_boto3(boto3.client(
+        's3',
+        config=Config(
+            max_pool_connections=FETCH_WORKERS,
+            retries={'max_attempts': 5, 'mode': 'adaptive'},
+        ),
+    ))
+
+
+def list_pending_keys(s3, bucket: str = BUCKET, prefix: str = PREFIX) -> List[str]:
+    """All manifest keys under prefix, across every page of the listing"""
+    keys = []
+    paginator = s3.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            key = obj['Key']
+            # Skip the directory marker and anything that isn't a manifest
+            if key != prefix and key.endswith('.json'):
+                keys.append(key)
+    return keys
+
+
+def fetch_manifest(s3, key: str, bucket: str = BUCKET) -> Dict[str, Any]:
+    with tracing.stage('fetch_manifest', key=key):
+        manifest_obj = s3.get_object(Bucket=bucket, Key=key)
+        return json.loads(manifest_obj['Body'].read().decode('utf-8'))
+
+
+def write_gallery(gallery_data: Dict[str, Any], md_path: Path, emitter: ContentEmitter) -> bool:
+    """Write a gallery page from a manifest; False if it was already up to date"""
+    post = frontmatter.Post(gallery_data.get('description', ''))
+    post['title'] = gallery_data['title']
+    post['date'] = gallery_data['date']
+    post['slug'] = gallery_data['slug']
+    post['tags'] = gallery_data.get('tags', [])
+    post['type'] = 'gallery'
+    post['photos'] = gallery_data['photos']
+
+    return emitter.write_text(md_path, frontmatter.dumps(post))
+
+
+def process_pending_galleries(
+    s3=None,
+    bucket: str = BUCKET,
+    prefix: str = PREFIX,
+    content_dir: Path = CONTENT_DIR,
+    workers: int = FETCH_WORKERS,
+    emitter: Optional[ContentEmitter] = None,
+) -> List[str]:
+    """Check S3 for pending galleries and create markdown files
+
+    Returns the manifest keys that were processed and deleted. A manifest
+    that can't be downloaded or parsed is reported and left for the next run.
+    """
+    s3 = s3 or make_s3_client()
+    emitter = emitter or ContentEmitter()
+
+    with tracing.stage('list'):
+        keys = list_pending_keys(s3, bucket, prefix)
+    if not keys:
         print("No pending galleries")
-        return
+        return []
 
-    content_dir = Path('content/galleries')
+    content_dir = Path(content_dir)
     content_dir.mkdir(parents=True, exist_ok=True)
 
-    for obj in response['Contents']:
-        key = obj['Key']
-
-        # Skip the directory marker
-        if key == prefix:
+    processed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(fetch_manifest, s3, key, bucket) for key in keys]
+
+        # Pages are written here, in listing order, as downloads complete
+        for key, future in zip(keys, futures):
+            print(f"Processing {key}")
+            try:
+                gallery_data = future.result()
+
+                # Markdown filename from key (e.g., pending-galleries/2025-01-15-slug.json)
+                md_path = content_dir / key[len(prefix):].replace('.json', '.md')
+                with tracing.stage('write', key=key):
+                    written = write_gallery(gallery_data, md_path, emitter)
+                if written:
+                    print(f"Created {md_path}")
+                else:
+                    print(f"Unchanged {md_path}")
+            except Exception as e:
+                print(f"Error processing {key}: {e}")
+                continue
+            processed.append(key)
+
+    # Manifests go only after every page above has been written and synced
+    with tracing.stage('delete', keys=len(processed)):
+        failed = set(delete_keys(s3, processed, bucket))
+    deleted = [key for key in processed if key not in failed]
+    print(f"Deleted {len(deleted)} manifests")
+
+    print(f"Done! {emitter.summary()}")
+    return deleted
+
+
+def collect_burst(notifications, debounce: float = DEBOUNCE_SECONDS,
+                  max_wait: float = MAX_BATCH_SECONDS) -> list:
+    """Wait for a notification, then keep taking more until the queue is quiet
+
+    Returns [] if nothing arrived within one poll.
+    """
+    messages = notifications.receive(POLL_SECONDS)
+    if not messages:
+        return []
+    started = time.monotonic()
+    while True:
+        remaining = max_wait - (time.monotonic() - started)
+        if remaining <= 0:
+            break
+        more = notifications.receive(min(debounce, remaining))
+        if not more:
+            break
+        messages.extend(more)
+    return messages
+
+
+def watch(
+    notifications,
+    rebuild_command: Optional[str] = None,
+    debounce: float = DEBOUNCE_SECONDS,
+    max_batches: Optional[int] = None,
+    **consumer_kwargs,
+):
+    """Process pending galleries whenever the queue reports new manifests
+
+    Each burst of notifications becomes one process_pending_galleries()
+    run and, if it created pages, one run of rebuild_command. Messages are
+    acknowledged once processed; a failed rebuild is retried on the next
+    poll. consumer_kwargs go to process_pending_galleries (s3, bucket, ...).
+    """
+    batches = 0
+    rebuild_pending = False
+    print("Watching for pending galleries")
+    while max_batches is None or batches < max_batches:
+        messages = collect_burst(notifications, debounce)
+        if not messages and not rebuild_pending:
             continue
+        batches += 1
+
+        if messages:
+            print(f"{len(messages)} gallery notifications")
+            try:
+                if process_pending_galleries(**consumer_kwargs):
+                    rebuild_pending = True
+            except Exception as e:
+                # Unacknowledged messages come back after the visibility timeout
+                print(f"Error processing pending galleries: {e}")
+                continue
+            notifications.delete(messages)
+
+        if rebuild_pending and rebuild_command:
+            print(f"Running {rebuild_command}")
+            result = subprocess.run(rebuild_command, shell=True)
+            if result.returncode != 0:
+                print(f"Rebuild failed with exit code {result.returncode}; will retry")
+                continue
+        rebuild_pending = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument(
+        '--watch',
+        action='store_true',
+        help='Run continuously, processing galleries as queue notifications arrive'
+    )
+    parser.add_argument(
+        '--queue-url',
+        default=os.getenv('GALLERY_QUEUE_URL'),
+        help='SQS queue gallery-service notifies (default: $GALLERY_QUEUE_URL)'
+    )
+    parser.add_argument(
+        '--rebuild-command',
+        default=os.getenv('GALLERY_REBUILD_COMMAND'),
+        help='Shell command run after new pages are written (default: $GALLERY_REBUILD_COMMAND)'
+    )
+    parser.add_argument(
+        '--debounce',
+        type=float,
+        default=DEBOUNCE_SECONDS,
+        help='Seconds of queue silence that end a burst of uploads'
+    )
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure_from_args('process_pending_galleries', args)
+
+    if not args.watch:
+        process_pending_galleries()
+        return
 
-        print(f"Processing {key}")
-
-        # Download manifest
-        manifest_obj = s3.get_object(Bucket=bucket, Key=key)
-        gallery_data = json.loads(manifest_obj['Body'].read().decode('utf-8'))
-
-        # Extract filename from key (e.g., pending-galleries/2025-01-15-slug.json)
-        filename = key.replace(prefix, '')
-
-        if not filename.endswith('.json'):
-            continue
-
-        # Create markdown filename
-        md_filename = filename.replace('.json', '.md')
-        md_path = content_dir / md_filename
-
-        # Create frontmatter post
-        post = frontmatter.Post(gallery_data.get('description', ''))
-        post['title'] = gallery_data['title']
-        post['date'] = gallery_data['date']
-        post['slug'] = gallery_data['slug']
-        post['tags'] = gallery_data.get('tags', [])
-        post['type'] = 'gallery'
-        post['photos'] = gallery_data['photos']
-
-        # Write markdown file
-        with open(md_path, 'w') as f:
-            f.write(frontmatter.dumps(post))
-
-        print(f"Created {md_path}")
-
-        # Delete processed manifest
-        s3.delete_object(Bucket=bucket, Key=key)
-        print(f"Deleted {key}")
+    if not args.queue_url:
+        parser.error('--watch needs --queue-url or GALLERY_QUEUE_URL')
+    watch(SQSQueue(args.queue_url), args.rebuild_command, args.debounce)
 
 
 if __name__ == '__main__':
-    process_pending_galleries()
+    main()
@@ -1,111 +1,241 @@
 #!/usr/bin/env python3
-"""Process gallery photos: download, resize, generate variants, upload to S3."""
+"""Process gallery photos: download, resize, generate variants, upload to S3.
 
+--trace records a span per gallery, photo, download, render, variant and
+S3 call; --profile profiles the gallery, photo and upload stages (see
+tracing.py). Variants render in encode-pool processes, which neither
+traces nor profiles: run with --jobs 1 to see inside the encoders.
+"""
+
+import argparse
 import hashlib
+import io
 import json
+import multiprocessing
 import os
 import subprocess
+import sys
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import BinaryIO, Dict, List, Optional, Tuple
 from urllib.parse import urlparse
 
 import boto3
 import exifread
 import frontmatter
 import requests
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# The fast-resize engine lives with gallery-service so both downscale the same way
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "gallery-service"))
+from imaging import load_resized, resize_to_width, scaled_size  # noqa: E402
+
+import tracing  # noqa: E402
+from content_writer import ContentEmitter  # noqa: E402
+from variant_cache import VariantCache  # noqa: E402
+
+
+JPEG_QUALITY = 85
+AVIF_QUALITY = 80
+
+# EXIF lives in a JPEG APP1 segment near the start of the file (segments
+# are capped at 64KB), so the first 128KB is enough to parse it
+EXIF_HEADER_BYTES = 128 * 1024
+DOWNLOAD_CHUNK_BYTES = 64 * 1024
+
+# Variant widths generated for every gallery photo
+VARIANT_SIZES = (320, 768, 1200, 1600)
+
+# Compact per-slug gallery index Hugo reads as site.Data.galleries
+GALLERY_DATA_PATH = Path("data/galleries.json")
+
+# Variant formats: extension -> (content type, encode quality)
+VARIANT_FORMATS = {
+    "jpg": ("image/jpeg", JPEG_QUALITY),
+    "avif": ("image/avif", AVIF_QUALITY),
+}
+
+
+def render_variants(
+    original_path: Path, output_dir: Path, base_name: str, sizes: List[int]
+) -> Dict[int, Dict[str, Path]]:
+    """Render every width of a photo as JPEG and AVIF from a single decode.
+
+    The source is decoded once (shrink-on-load, at the largest width) and the
+    smaller widths are cascaded down from that in-memory image, so AVIF is
+    encoded from the same pixels as the JPEG rather than from the JPEG file.
+    Returns {width: {"jpg": path, "avif": path}}; "avif" is missing if that
+    encode failed, and the whole result is empty if the source can't be read.
+    """
+    try:
+        img = load_resized(original_path, max(sizes))
+    except Exception as e:
+        print(f"Error decoding {original_path}: {e}")
+        return {}
+
+    rendered = {}
+    for size in sorted(sizes, reverse=True):
+        with tracing.span(f"variant {size}w", "render", photo=base_name):
+            img = resize_to_width(img, size)
+            jpeg_img = img if img.mode in ("RGB", "L", "CMYK") else img.convert("RGB")
+
+            jpeg_path = output_dir / f"{base_name}_{size}w.jpg"
+            try:
+                jpeg_img.save(jpeg_path, "JPEG", quality=JPEG_QUALITY, optimize=True)
+            except Exception as e:
+                print(f"Error resizing {original_path} to {size}px: {e}")
+                continue
+            rendered[size] = {"jpg": jpeg_path}
+
+            avif_path = output_dir / f"{base_name}_{size}w.avif"
+            try:
+                img.save(avif_path, "AVIF", quality=AVIF_QUALITY)
+                rendered[size]["avif"] = avif_path
+            except Exception as e:
+                print(f"Error converting to AVIF: {e}")
+
+    return rendered
 
 
 class PhotoProcessor:
     """Processes gallery photos for responsive web display."""
 
-    def __init__(self):
+    def __init__(self, jobs: Optional[int] = None, variant_cache: Optional[VariantCache] = None):
         self.galleries_dir = Path("content/galleries")
         self.static_media_dir = Path("static/media/galleries")
         self.static_media_dir.mkdir(parents=True, exist_ok=True)
 
-        # AWS setup
-        self.s3_client = boto3.client("s3")
+        # Parallelism: encode processes, plus threads for network I/O
+        self.jobs = jobs or os.cpu_count() or 1
+        self.io_workers = max(8, self.jobs * 4)
+
+        # AWS setup (one client shared by all upload threads)
+        self.s3_client = tracing.instrument_boto3(
+            boto3.client("s3", config=Config(max_pool_connections=self.io_workers))
+        )
         self.media_bucket = os.getenv("MEDIA_BUCKET")
         self.media_base_url = os.getenv("BASEURL", "https://i.clintecker.com")
 
+        # Pooled keep-alive connections for photo downloads; the photo pool
+        # bounds how many run at once
+        self.http = tracing.instrument_session(requests.Session())
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=self.jobs * 2,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+        )
+        self.http.mount("https://", adapter)
+        self.http.mount("http://", adapter)
+
         # Image sizes to generate
-        self.sizes = [320, 768, 1200, 1600]
-
-    def _get_file_hash(self, filepath: Path) -> str:
-        """Generate SHA256 hash of a file for cache-busting."""
-        sha256 = hashlib.sha256()
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                sha256.update(chunk)
-        return sha256.hexdigest()[:12]
-
-    def _download_photo(self, url: str, output_path: Path) -> bool:
-        """Download a photo from URL."""
+        self.sizes = list(VARIANT_SIZES)
+
+        # Published variants, so unchanged photos aren't encoded and uploaded again
+        self.variant_cache = variant_cache or VariantCache()
+
+        # Manifests and gallery pages are only rewritten when their bytes change
+        self.emitter = ContentEmitter()
+
+        # Separate pools so a stage never waits on work queued behind itself:
+        # galleries fan out to photos, photos to encodes and uploads
+        self.gallery_pool = ThreadPoolExecutor(
+            max_workers=min(4, self.jobs), thread_name_prefix="gallery"
+        )
+        self.photo_pool = ThreadPoolExecutor(
+            max_workers=self.jobs * 2, thread_name_prefix="photo"
+        )
+        self.upload_pool = ThreadPoolExecutor(
+            max_workers=self.io_workers, thread_name_prefix="upload"
+        )
+        # forkserver: the pool starts from photo threads, and forking a
+        # threaded process is unsafe; spawn where there is no forkserver
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+        self.encode_pool = (
+            ProcessPoolExecutor(max_workers=self.jobs, mp_context=context)
+            if self.jobs > 1
+            else None
+        )
+
+    def close(self):
+        """Shut down worker pools."""
+        for pool in (self.gallery_pool, self.photo_pool, self.upload_pool, self.encode_pool):
+            if pool is not None:
+                pool.shutdown()
+        self.http.close()
+        self.variant_cache.close()
+
+    def _render(
+        self, original_path: Path, output_dir: Path, base_name: str
+    ) -> Dict[int, Dict[str, Path]]:
+        """Run render_variants in the encode pool (or inline with --jobs 1)."""
+        with tracing.span("render", "render", photo=base_name):
+            if self.encode_pool is None:
+                return render_variants(original_path, output_dir, base_name, self.sizes)
+            return self.encode_pool.submit(
+                render_variants, original_path, output_dir, base_name, self.sizes
+            ).result()
+
+    def _download_photo(
+        self, url: str, output_path: Path
+    ) -> Optional[Tuple[str, Dict[str, str], Tuple[int, int]]]:
+        """Download a photo from URL, hashing it and reading EXIF and size on the way.
+
+        Returns (SHA-256 hex digest, EXIF data, (width, height)), or None if
+        the download failed. The file is only re-read for the size if its
+        header doesn't fit in the first EXIF_HEADER_BYTES.
+        """
         try:
-            response = requests.get(url, timeout=30, stream=True)
-            response.raise_for_status()
-            with open(output_path, "wb") as f:
-                for chunk in response.iter_content(chunk_size=8192):
-                    f.write(chunk)
-            return True
+            sha256 = hashlib.sha256()
+            header = bytearray()
+            with tracing.span("download", "http", url=url), \
+                    self.http.get(url, timeout=30, stream=True) as response:
+                response.raise_for_status()
+                with open(output_path, "wb") as f:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        if len(header) < EXIF_HEADER_BYTES:
+                            header += chunk[: EXIF_HEADER_BYTES - len(header)]
         except Exception as e:
             print(f"Error downloading {url}: {e}")
-            return False
+            return None
+
+        return (
+            sha256.hexdigest(),
+            self._extract_exif(io.BytesIO(header), url),
+            self._image_size(bytes(header), output_path),
+        )
+
+    def _image_size(self, header: bytes, path: Path) -> Tuple[int, int]:
+        """Pixel size from the image header, without decoding; (0, 0) if unknown."""
+        for source in (io.BytesIO(header), path):
+            try:
+                with Image.open(source) as img:
+                    return img.size
+            except Exception:
+                continue
+        return 0, 0
 
-    def _extract_exif(self, filepath: Path) -> Dict[str, str]:
-        """Extract useful EXIF data from image."""
+    def _extract_exif(self, f: BinaryIO, name: str) -> Dict[str, str]:
+        """Extract useful EXIF data from the leading bytes of an image."""
         exif_data = {}
         try:
-            with open(filepath, "rb") as f:
-                tags = exifread.process_file(f, details=False)
-                if "EXIF DateTimeOriginal" in tags:
-                    exif_data["date"] = str(tags["EXIF DateTimeOriginal"])
-                if "Image Model" in tags:
-                    exif_data["camera"] = str(tags["Image Model"])
-                if "EXIF FocalLength" in tags:
-                    exif_data["focal_length"] = str(tags["EXIF FocalLength"])
+            tags = exifread.process_file(f, details=False)
+            if "EXIF DateTimeOriginal" in tags:
+                exif_data["date"] = str(tags["EXIF DateTimeOriginal"])
+            if "Image Model" in tags:
+                exif_data["camera"] = str(tags["Image Model"])
+            if "EXIF FocalLength" in tags:
+                exif_data["focal_length"] = str(tags["EXIF FocalLength"])
         except Exception as e:
-            print(f"Error reading EXIF from {filepath}: {e}")
+            print(f"Error reading EXIF from {name}: {e}")
         return exif_data
 
-    def _resize_image(
-        self, input_path: Path, output_path: Path, width: int, quality: int = 85
-    ) -> bool:
-        """Resize image using Pillow."""
-        try:
-            with Image.open(input_path) as img:
-                # Calculate height maintaining aspect ratio
-                aspect_ratio = img.height / img.width
-                height = int(width * aspect_ratio)
-
-                # Only resize if image is larger than target
-                if img.width > width:
-                    img = img.resize((width, height), Image.Resampling.LANCZOS)
-
-                # Save with optimization
-                if output_path.suffix.lower() in [".jpg", ".jpeg"]:
-                    img.save(output_path, "JPEG", quality=quality, optimize=True)
-                elif output_path.suffix.lower() == ".avif":
-                    # Pillow 10+ supports AVIF
-                    img.save(output_path, "AVIF", quality=quality)
-                else:
-                    img.save(output_path, quality=quality, optimize=True)
-            return True
-        except Exception as e:
-            print(f"Error resizing {input_path} to {width}px: {e}")
-            return False
-
-    def _convert_to_avif(self, input_path: Path, output_path: Path) -> bool:
-        """Convert image to AVIF using Pillow."""
-        try:
-            with Image.open(input_path) as img:
-                img.save(output_path, "AVIF", quality=80)
-            return True
-        except Exception as e:
-            print(f"Error converting to AVIF: {e}")
-            return False
-
     def _upload_to_s3(
         self, local_path: Path, s3_key: str, content_type: str, cache_control: str
     ) -> Optional[str]:
@@ -115,96 +245,175 @@ class PhotoProcessor:
             return None
 
         try:
-            self.s3_client.upload_file(
-                str(local_path),
-                self.media_bucket,
-                s3_key,
-                ExtraArgs={
-                    "ContentType": content_type,
-                    "CacheControl": cache_control,
-                },
-            )
+            with tracing.stage("upload", key=s3_key):
+                self.s3_client.upload_file(
+                    str(local_path),
+                    self.media_bucket,
+                    s3_key,
+                    ExtraArgs={
+                        "ContentType": content_type,
+                        "CacheControl": cache_control,
+                    },
+                )
             return f"{self.media_base_url}/{s3_key}"
         except Exception as e:
             print(f"Error uploading {s3_key} to S3: {e}")
             return None
 
-    def _process_gallery_photos(
-        self, gallery_slug: str, photo_urls: List[str]
-    ) -> List[Dict]:
-        """Process all photos in a gallery."""
-        gallery_dir = self.static_media_dir / gallery_slug
-        gallery_dir.mkdir(parents=True, exist_ok=True)
-
-        temp_dir = gallery_dir / "temp"
-        temp_dir.mkdir(exist_ok=True)
-
-        processed_photos = []
-
-        for idx, url in enumerate(photo_urls):
-            print(f"Processing photo {idx + 1}/{len(photo_urls)}: {url}")
+    def _process_photo(
+        self, gallery_slug: str, gallery_dir: Path, temp_dir: Path, idx: int, url: str, total: int
+    ) -> Optional[Dict]:
+        """Download, render and upload one photo; None if it failed."""
+        with tracing.stage("photo", gallery=gallery_slug, index=idx):
+            print(f"Processing photo {idx + 1}/{total}: {url}")
 
             # Download original
             parsed_url = urlparse(url)
             ext = Path(parsed_url.path).suffix or ".jpg"
             original_path = temp_dir / f"original_{idx}{ext}"
 
-            if not self._download_photo(url, original_path):
-                continue
-
-            # Extract EXIF
-            exif = self._extract_exif(original_path)
-
-            # Generate hash for cache-busting
-            file_hash = self._get_file_hash(original_path)
-            base_name = f"photo_{idx}_{file_hash}"
+            # Download once; hash and EXIF come from the bytes as they stream in
+            downloaded = self._download_photo(url, original_path)
+            if not downloaded:
+                return None
+            source_hash, exif, original_size = downloaded
 
-            variants = {}
+            # Hash identifies the source for the variant cache; its prefix busts CDN caches
+            base_name = f"photo_{idx}_{source_hash[:12]}"
 
-            # Generate variants for each size
+            # Reuse variants that are already published or rendered locally
+            variants: Dict[str, Dict[str, str]] = {}
+            pending: Dict[int, Dict[str, Path]] = {}
+            needs_render = False
             for size in self.sizes:
-                # JPEG variant
-                jpeg_filename = f"{base_name}_{size}w.jpg"
-                jpeg_path = gallery_dir / jpeg_filename
-                if self._resize_image(original_path, jpeg_path, size):
-                    s3_key = f"galleries/{gallery_slug}/{jpeg_filename}"
-                    jpeg_url = self._upload_to_s3(
-                        jpeg_path,
-                        s3_key,
-                        "image/jpeg",
-                        "public, max-age=31536000, immutable",
+                for fmt in VARIANT_FORMATS:
+                    filename = f"{base_name}_{size}w.{fmt}"
+                    variant_url = self._published_variant(
+                        source_hash, gallery_slug, filename, size, fmt
                     )
-
-                    # AVIF variant
-                    avif_filename = f"{base_name}_{size}w.avif"
-                    avif_path = gallery_dir / avif_filename
-                    if self._convert_to_avif(jpeg_path, avif_path):
-                        avif_s3_key = f"galleries/{gallery_slug}/{avif_filename}"
-                        avif_url = self._upload_to_s3(
-                            avif_path,
-                            avif_s3_key,
-                            "image/avif",
-                            "public, max-age=31536000, immutable",
-                        )
-
-                        variants[f"{size}w"] = {
-                            "jpg": jpeg_url or f"/media/galleries/{gallery_slug}/{jpeg_filename}",
-                            "avif": avif_url
-                            or f"/media/galleries/{gallery_slug}/{avif_filename}",
-                        }
+                    if variant_url:
+                        variants.setdefault(f"{size}w", {})[fmt] = variant_url
+                    elif (gallery_dir / filename).exists():
+                        pending.setdefault(size, {})[fmt] = gallery_dir / filename
                     else:
-                        variants[f"{size}w"] = {
-                            "jpg": jpeg_url or f"/media/galleries/{gallery_slug}/{jpeg_filename}",
-                        }
-
-            processed_photos.append(
-                {
-                    "alt": f"Photo {idx + 1}",
-                    "caption": "",
-                    "exif": exif,
-                    "variants": variants,
+                        needs_render = True
+
+            if needs_render:
+                # Decode once, generate every size and format from those pixels
+                rendered = self._render(original_path, gallery_dir, base_name)
+                for size, formats in rendered.items():
+                    for fmt, path in formats.items():
+                        if fmt not in variants.get(f"{size}w", {}):
+                            pending.setdefault(size, {})[fmt] = path
+
+            if not variants and not pending:
+                return None
+
+            # Upload every new variant concurrently
+            uploads: Dict[int, Dict[str, Future]] = {
+                size: {
+                    fmt: self._submit_upload(gallery_slug, path, VARIANT_FORMATS[fmt][0])
+                    for fmt, path in formats.items()
                 }
+                for size, formats in pending.items()
+            }
+
+            for size, formats in uploads.items():
+                for fmt, upload in formats.items():
+                    filename = pending[size][fmt].name
+                    variant_url = upload.result()
+                    if variant_url:
+                        self.variant_cache.put(
+                            source_hash,
+                            size,
+                            fmt,
+                            VARIANT_FORMATS[fmt][1],
+                            f"galleries/{gallery_slug}/{filename}",
+                            variant_url,
+                        )
+                    variants.setdefault(f"{size}w", {})[fmt] = (
+                        variant_url or f"/media/galleries/{gallery_slug}/{filename}"
+                    )
+
+            # Manifest order: widths ascending, jpg before avif; no jpg, no variant
+            ordered = {}
+            for size in self.sizes:
+                formats = variants.get(f"{size}w", {})
+                if "jpg" in formats:
+                    ordered[f"{size}w"] = {
+                        fmt: formats[fmt] for fmt in VARIANT_FORMATS if fmt in formats
+                    }
+
+            photo = {
+                "alt": f"Photo {idx + 1}",
+                "caption": "",
+                "exif": exif,
+                "variants": ordered,
+            }
+            if ordered and original_size[0]:
+                # Size of the largest variant (variants never upscale the original)
+                largest = int(next(reversed(ordered))[:-1])
+                if original_size[0] > largest:
+                    original_size = scaled_size(original_size, largest)
+                photo["width"], photo["height"] = original_size
+            return photo
+
+    def _published_variant(
+        self, source_hash: str, gallery_slug: str, filename: str, size: int, fmt: str
+    ) -> Optional[str]:
+        """URL of an already-published variant, from the cache or the bucket."""
+        quality = VARIANT_FORMATS[fmt][1]
+        url = self.variant_cache.get(source_hash, size, fmt, quality)
+        if url or not self.media_bucket:
+            return url
+
+        # Uploaded by a run whose cache wasn't saved; record it now
+        s3_key = f"galleries/{gallery_slug}/{filename}"
+        try:
+            self.s3_client.head_object(Bucket=self.media_bucket, Key=s3_key)
+        except ClientError:
+            return None
+        url = f"{self.media_base_url}/{s3_key}"
+        self.variant_cache.put(source_hash, size, fmt, quality, s3_key, url)
+        return url
+
+    def _submit_upload(self, gallery_slug: str, local_path: Path, content_type: str) -> Future:
+        """Queue an immutable variant upload on the upload pool."""
+        return self.upload_pool.submit(
+            self._upload_to_s3,
+            local_path,
+            f"galleries/{gallery_slug}/{local_path.name}",
+            content_type,
+            "public, max-age=31536000, immutable",
+        )
+
+    def _process_gallery_photos(
+        self, gallery_slug: str, photo_urls: List[str]
+    ) -> List[Dict]:
+        """Process all photos in a gallery concurrently, keeping their order."""
+        gallery_dir = self.static_media_dir / gallery_slug
+        gallery_dir.mkdir(parents=True, exist_ok=True)
+
+        temp_dir = gallery_dir / "temp"
+        temp_dir.mkdir(exist_ok=True)
+
+        futures = [
+            self.photo_pool.submit(
+                self._process_photo, gallery_slug, gallery_dir, temp_dir, idx, url, len(photo_urls)
             )
+            for idx, url in enumerate(photo_urls)
+        ]
+
+        processed_photos = []
+        for url, future in zip(photo_urls, futures):
+            # One bad photo is skipped; it never takes the gallery down with it
+            try:
+                photo = future.result()
+            except Exception as e:
+                print(f"Error processing {url}: {e}")
+                continue
+            if photo:
+                processed_photos.append(photo)
 
         return processed_photos
 
@@ -213,8 +422,7 @@ class PhotoProcessor:
         manifest = {"gallery": gallery_slug, "items": photos}
 
         manifest_path = self.static_media_dir / gallery_slug / "manifest.json"
-        with open(manifest_path, "w") as f:
-            json.dump(manifest, f, indent=2)
+        written = self.emitter.write_text(manifest_path, json.dumps(manifest, indent=2))
 
         # Upload manifest to S3
         if self.media_bucket:
@@ -226,39 +434,121 @@ class PhotoProcessor:
                 "public, max-age=300",  # 5 minute cache
             )
 
-        print(f"Created manifest: {manifest_path}")
-
-    def process_all_galleries(self):
-        """Process all galleries that have source_photos."""
-        if not self.galleries_dir.exists():
-            print("No galleries directory found")
-            return
-
-        for gallery_file in self.galleries_dir.glob("*.md"):
-            with open(gallery_file, "r") as f:
-                post = frontmatter.load(f)
-
-            # Check if gallery needs processing
-            if "source_photos" not in post.metadata:
-                continue
+        print(f"{'Created' if written else 'Unchanged'} manifest: {manifest_path}")
+
+    def _write_gallery_data(self, galleries: Dict[str, List[Dict]]):
+        """Merge processed galleries into the data file Hugo templates read.
+
+        Keyed by slug, with only what the gallery partial renders (no EXIF)
+        and no indentation, so builds read one small file instead of fetching
+        and parsing a manifest per gallery page.
+        """
+        data: Dict[str, Dict] = {}
+        if GALLERY_DATA_PATH.exists():
+            with open(GALLERY_DATA_PATH, "r") as f:
+                data = json.load(f)
+
+        fields = ("alt", "caption", "width", "height", "variants")
+        for slug, photos in galleries.items():
+            data[slug] = {
+                "manifest": f"/media/galleries/{slug}/manifest.json",
+                "items": [{key: photo[key] for key in fields if key in photo} for photo in photos],
+            }
+
+        GALLERY_DATA_PATH.parent.mkdir(parents=True, exist_ok=True)
+        if self.emitter.write_text(
+            GALLERY_DATA_PATH, json.dumps(dict(sorted(data.items())), separators=(",", ":"))
+        ):
+            print(f"Updated {GALLERY_DATA_PATH} ({len(data)} galleries)")
+
+    def _process_gallery(self, gallery_file: Path) -> Optional[Tuple[str, List[Dict]]]:
+        """Process one gallery file if it still has source_photos.
+
+        Returns (slug, manifest items) when the gallery was processed.
+        """
+        with open(gallery_file, "r") as f:
+            post = frontmatter.load(f)
+
+        # Check if gallery needs processing
+        if "source_photos" not in post.metadata:
+            return None
 
-            slug = post.get("slug", gallery_file.stem)
-            photo_urls = post["source_photos"]
+        slug = post.get("slug", gallery_file.stem)
+        photo_urls = post["source_photos"]
 
-            print(f"\nProcessing gallery: {slug}")
+        print(f"\nProcessing gallery: {slug}")
+        with tracing.stage("gallery", slug=slug, photos=len(photo_urls)):
             photos = self._process_gallery_photos(slug, photo_urls)
 
             if photos:
-                self._create_manifest(slug, photos)
+                with tracing.span("manifest", "gallery", slug=slug):
+                    self._create_manifest(slug, photos)
 
                 # Remove source_photos from frontmatter (processed)
                 del post.metadata["source_photos"]
-                with open(gallery_file, "w") as f:
-                    f.write(frontmatter.dumps(post))
+                self.emitter.write_text(gallery_file, frontmatter.dumps(post))
 
                 print(f"Completed gallery: {slug}")
+                return slug, photos
+        if photo_urls:
+            # Keeps source_photos; counted as failed so the run isn't recorded as done
+            raise RuntimeError(f"none of its {len(photo_urls)} photos could be processed")
+        return None
+
+    def process_all_galleries(self) -> int:
+        """Process all galleries that have source_photos, several at a time.
+
+        Returns how many galleries failed and still have source_photos.
+        """
+        if not self.galleries_dir.exists():
+            print("No galleries directory found")
+            return 0
+
+        gallery_files = sorted(self.galleries_dir.glob("*.md"))
+        futures = [self.gallery_pool.submit(self._process_gallery, f) for f in gallery_files]
+
+        failed = 0
+        processed: Dict[str, List[Dict]] = {}
+        for gallery_file, future in zip(gallery_files, futures):
+            # A failing gallery keeps its source_photos and is retried next run
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                print(f"Error processing gallery {gallery_file}: {e}")
+                continue
+            if result:
+                slug, photos = result
+                processed[slug] = photos
+
+        if processed:
+            self._write_gallery_data(processed)
+
+        if failed:
+            print(f"{failed} galleries failed")
+        print(f"Galleries done ({self.emitter.summary()})")
+        return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="encode processes to run in parallel (default: CPU count; 1 = no pool)",
+    )
+    tracing.add_arguments(parser)
+    args = parser.parse_args()
+    tracing.configure_from_args("process_photos", args)
+
+    processor = PhotoProcessor(jobs=args.jobs)
+    try:
+        processor.process_all_galleries()
+    finally:
+        processor.close()
 
 
 if __name__ == "__main__":
-    processor = PhotoProcessor()
-    processor.process_all_galleries()
+    main()
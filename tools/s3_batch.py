@@ -0,0 +1,21 @@
+"""Batched S3 operations shared by the build tools."""
+
+from typing import List
+
+# Most keys a single DeleteObjects call accepts
+DELETE_BATCH_SIZE = 1000
+
+
+def delete_keys(s3, keys: List[str], bucket: str) -> List[str]:
+    """Delete keys in DeleteObjects batches; returns the keys that failed."""
+    failed = []
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        batch = keys[start:start + DELETE_BATCH_SIZE]
+        response = s3.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+        )
+        for error in response.get("Errors", []):
+            print(f"Error deleting {error['Key']}: {error.get('Message', error.get('Code'))}")
+            failed.append(error["Key"])
+    return failed
@@ -0,0 +1,125 @@
+"""Persistent record of which Micro.blog items have been turned into content.
+
+Replaces the list-based data/cache.json: lookups hit a primary-key index
+instead of scanning a list, each processed item is committed as it is
+written instead of rewriting the whole file at the end of a run, and every
+item carries a hash of its feed JSON. An existing cache.json is imported
+the first time the store is opened and left in place.
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS items (
+    kind TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    content_hash TEXT,
+    processed_at REAL NOT NULL,
+    PRIMARY KEY (kind, item_id)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def item_hash(item: Dict[str, Any]) -> str:
+    """Stable hash of a feed item's JSON."""
+    encoded = json.dumps(item, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class StateStore:
+    """SQLite-backed set of processed item ids, per kind ("posts", "bookmarks")."""
+
+    def __init__(
+        self,
+        path: Path = Path("data/state.sqlite"),
+        legacy_cache_path: Optional[Path] = Path("data/cache.json"),
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.executescript(SCHEMA)
+        if legacy_cache_path is not None:
+            self._migrate_legacy_cache(Path(legacy_cache_path))
+
+    def _migrate_legacy_cache(self, cache_path: Path):
+        """Import ids from cache.json once; the JSON file is not modified."""
+        if not cache_path.exists() or self.get_meta("migrated_cache_json"):
+            return
+
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+
+        now = time.time()
+        with self._conn:
+            for kind, item_ids in cache.items():
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO items (kind, item_id, content_hash, processed_at)"
+                    " VALUES (?, ?, NULL, ?)",
+                    [(kind, str(item_id), now) for item_id in item_ids],
+                )
+            self._set_meta("migrated_cache_json", str(cache_path))
+        print(f"Migrated {cache_path} into {self.path}")
+
+    def seen(self, kind: str, item_id: Any) -> bool:
+        """True if the item has already been processed."""
+        row = self._conn.execute(
+            "SELECT 1 FROM items WHERE kind = ? AND item_id = ?", (kind, str(item_id))
+        ).fetchone()
+        return row is not None
+
+    def mark(self, kind: str, item_id: Any, content_hash: Optional[str] = None):
+        """Record an item as processed and commit immediately."""
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO items (kind, item_id, content_hash, processed_at)"
+                " VALUES (?, ?, ?, ?)",
+                (kind, str(item_id), content_hash, time.time()),
+            )
+
+    def mark_many(self, processed: Iterable[Tuple[str, Any, Optional[str]]]):
+        """Record (kind, item_id, content_hash) rows in a single transaction."""
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO items (kind, item_id, content_hash, processed_at)"
+                " VALUES (?, ?, ?, ?)",
+                [(kind, str(item_id), content_hash, now) for kind, item_id, content_hash in processed],
+            )
+
+    def ids(self, kind: str) -> Set[str]:
+        """All processed ids of a kind, as strings."""
+        return {
+            row[0]
+            for row in self._conn.execute("SELECT item_id FROM items WHERE kind = ?", (kind,))
+        }
+
+    def count(self, kind: str) -> int:
+        """Number of processed items of a kind."""
+        return self._conn.execute(
+            "SELECT COUNT(*) FROM items WHERE kind = ?", (kind,)
+        ).fetchone()[0]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str):
+        with self._conn:
+            self._set_meta(key, value)
+
+    def _set_meta(self, key: str, value: str):
+        self._conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value)
+        )
+
+    def close(self):
+        self._conn.close()
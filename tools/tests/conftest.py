@@ -0,0 +1,6 @@
+"""The tools import each other as top-level modules, as when run from tools/."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,84 @@
+"""ContentEmitter: skipping identical files, atomic replaces and its counts."""
+
+import os
+import threading
+
+import pytest
+
+from content_writer import ContentEmitter
+
+
+def test_new_file_is_written(tmp_path):
+    emitter = ContentEmitter()
+    path = tmp_path / "post.md"
+
+    assert emitter.write_text(path, "hello\n") is True
+    assert path.read_text() == "hello\n"
+    assert (emitter.written, emitter.skipped) == (1, 0)
+
+
+def test_identical_content_is_skipped(tmp_path):
+    path = tmp_path / "post.md"
+    path.write_text("hello\n")
+    os.utime(path, (1_000_000, 1_000_000))
+
+    emitter = ContentEmitter()
+    assert emitter.write_text(path, "hello\n") is False
+    # Untouched, so Hugo and git both see no change
+    assert path.stat().st_mtime == 1_000_000
+    assert (emitter.written, emitter.skipped) == (0, 1)
+
+
+def test_changed_content_of_the_same_size_is_replaced(tmp_path):
+    path = tmp_path / "post.md"
+    path.write_text("hello\n")
+
+    emitter = ContentEmitter()
+    assert emitter.unchanged(path, b"jello\n") is False
+    assert emitter.write_bytes(path, b"jello\n") is True
+    assert path.read_bytes() == b"jello\n"
+    assert emitter.summary() == "1 files written, 0 unchanged"
+
+
+def test_replace_keeps_the_file_mode_and_leaves_no_temp_files(tmp_path):
+    path = tmp_path / "post.md"
+    path.write_text("old")
+    path.chmod(0o640)
+
+    ContentEmitter().write_text(path, "new")
+    assert path.stat().st_mode & 0o777 == 0o640
+    assert [p.name for p in tmp_path.iterdir()] == ["post.md"]
+
+
+def test_failed_write_leaves_the_original(tmp_path, monkeypatch):
+    path = tmp_path / "post.md"
+    path.write_text("old")
+
+    def broken_replace(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(os, "replace", broken_replace)
+    emitter = ContentEmitter()
+    with pytest.raises(OSError):
+        emitter.write_text(path, "new")
+
+    assert path.read_text() == "old"
+    assert [p.name for p in tmp_path.iterdir()] == ["post.md"]
+    assert (emitter.written, emitter.skipped) == (0, 0)
+
+
+def test_counts_are_exact_across_threads(tmp_path):
+    emitter = ContentEmitter()
+    for i in range(0, 40, 2):
+        (tmp_path / f"{i}.md").write_text(str(i))
+
+    threads = [
+        threading.Thread(target=emitter.write_text, args=(tmp_path / f"{i}.md", str(i)))
+        for i in range(40)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert emitter.summary() == "20 files written, 20 unchanged"
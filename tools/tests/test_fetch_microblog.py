@@ -0,0 +1,45 @@
+"""Photo-post classification in MicroblogFetcher."""
+
+import pytest
+
+from fetch_microblog import MicroblogFetcher
+
+PHOTO = {"mime_type": "image/jpeg", "url": "https://clintecker.com/uploads/a.jpg", "title": "Lake"}
+
+
+@pytest.fixture
+def fetcher(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return MicroblogFetcher(state_path="state.sqlite", cache_path="cache.json")
+
+
+def test_photos_come_from_image_attachments(fetcher):
+    item = {
+        "content_html": '<p><img src="https://clintecker.com/uploads/inline.jpg"></p>',
+        "attachments": [PHOTO, {"mime_type": "audio/mpeg", "url": "https://x/a.mp3"}],
+    }
+    assert fetcher._extract_photos(item) == [
+        {"url": "https://clintecker.com/uploads/a.jpg", "alt": "Lake"}
+    ]
+
+
+def test_inline_images_alone_are_not_a_photo_post(fetcher):
+    item = {"content_html": '<p><img src="https://clintecker.com/uploads/inline.jpg"></p>'}
+    assert fetcher._extract_photos(item) == []
+    assert not fetcher._is_photo_post(item)
+
+
+@pytest.mark.parametrize(
+    "content_html, is_photo_post",
+    [
+        ('<p><img src="https://clintecker.com/uploads/a.jpg" alt="Lake"></p>', True),
+        # Markup, entities and alt text don't count towards the 200 characters
+        ("<p>" + "<b>x</b> &amp; " * 40 + "</p>", True),
+        ("<p>" + "x" * 199 + "</p>", True),
+        ("<p>" + "x" * 200 + "</p>", False),
+        ("<ul>" + "<li>item</li>" * 50 + "</ul>", False),
+    ],
+)
+def test_photo_post_needs_short_text(fetcher, content_html, is_photo_post):
+    item = {"content_html": content_html, "attachments": [PHOTO]}
+    assert fetcher._is_photo_post(item) is is_photo_post
@@ -0,0 +1,95 @@
+"""html_markdown.convert on the kinds of fragments Micro.blog sends."""
+
+import pytest
+
+from html_markdown import SIMPLE_FRAGMENT_RE, _MarkdownBuilder, convert
+
+# (content_html, Markdown, plain text)
+CASES = [
+    (
+        '<p>Walked to the lake &amp; the <a href="https://example.com/coffee">coffee place</a>'
+        " was open.</p>",
+        "Walked to the lake & the [coffee place](https://example.com/coffee) was open.",
+        "Walked to the lake & the coffee place was open.",
+    ),
+    (
+        '<p>Reading <em>this</em> today:</p>\n<blockquote>\n<p>Quoted from '
+        '<a href="https://ex.com/a">an article</a>.</p>\n</blockquote>\n<p>Worth it.</p>',
+        "Reading *this* today:\n\n> Quoted from [an article](https://ex.com/a).\n\nWorth it.",
+        "Reading this today:\nQuoted from an article.\nWorth it.",
+    ),
+    (
+        "<ul><li>one</li><li>two<ol><li>first</li><li>second</li></ol></li></ul>",
+        "- one\n- two\n  1. first\n  2. second",
+        "one\ntwo\nfirst\nsecond",
+    ),
+    (
+        "<pre><code>if a &lt; b:\n    pass</code></pre>"
+        "<p>Use <code>pip</code> and <strong>bold</strong>.</p>",
+        "```\nif a < b:\n    pass\n```\n\nUse `pip` and **bold**.",
+        "if a < b:\npass\nUse pip and bold.",
+    ),
+    ("<h2>Title</h2><p>line<br>break</p><hr>", "## Title\n\nline\nbreak\n\n---", "Title\nline\nbreak"),
+    # A literal < stays escaped so Hugo doesn't read it back as HTML
+    ("<p>1 &lt; 2 and <b>x</b></p>", "1 &lt; 2 and **x**", "1 < 2 and x"),
+    # Only the outermost of nested anchors becomes a link
+    ('<a href="https://a"><a href="https://b">nested</a></a>', "[nested](https://a)", "nested"),
+    # Misnested link and quote: no crash, nothing lost
+    ('<blockquote><a href="https://h">x</blockquote></a>', "> x", "x"),
+    ('<a href="https://h"><blockquote>x</a></blockquote>', "[x](https://h)", "x"),
+    ('<a href="https://h"><p></div></blockquote><br/></a>&amp; z.', "[https://h](https://h)& z.", "& z."),
+    ('<p>unclosed <a href="https://u">link', "unclosed link", "unclosed link"),
+    # HTMLParser-only input: raw-text tags, comments, single quotes
+    ("<p>hi<script>alert(1)</script> there</p>", "hi there", "hi there"),
+    ("<p><a href='https://single'>single</a><!-- c --></p>", "[single](https://single)", "single"),
+    ("Just plain text,   no tags", "Just plain text, no tags", "Just plain text, no tags"),
+]
+
+
+@pytest.mark.parametrize("html, markdown, text", CASES)
+def test_convert(html, markdown, text):
+    result = convert(html)
+    assert result.markdown == markdown
+    assert result.text == text
+    assert result.text_length == len(text)
+
+
+def test_images_are_collected_with_alt_text():
+    result = convert(
+        '<p><img src="https://clintecker.com/uploads/a.jpg" width="600" alt="Sunset &amp; lake">'
+        '<img src="https://clintecker.com/uploads/b.jpg"/><img alt="no source"></p>'
+    )
+    assert result.images == (
+        ("https://clintecker.com/uploads/a.jpg", "Sunset & lake"),
+        ("https://clintecker.com/uploads/b.jpg", ""),
+    )
+    assert result.markdown == (
+        "![Sunset & lake](https://clintecker.com/uploads/a.jpg)"
+        "![](https://clintecker.com/uploads/b.jpg)"
+    )
+    assert result.text_length == 0
+
+
+@pytest.mark.parametrize("html", [html for html, _, _ in CASES])
+def test_fast_path_matches_html_parser(html):
+    builder = _MarkdownBuilder()
+    builder.feed(html)
+    builder.close()
+    assert convert.__wrapped__(html) == builder.result()
+
+
+@pytest.mark.parametrize(
+    "html, simple",
+    [
+        ('<p class="x">a &amp; b<br/></p>', True),
+        ('<IMG SRC="a.jpg" ALT="x">', True),
+        ("<script>x</script>", False),
+        ("<STYLE>x</STYLE>", False),
+        ("<!-- c --><p>x</p>", False),
+        ("<a href='x'>y</a>", False),
+        ("<input disabled>", False),
+        ("<p>a < b</p>", False),
+    ],
+)
+def test_fast_path_only_takes_plain_tags(html, simple):
+    assert bool(SIMPLE_FRAGMENT_RE.fullmatch(html)) is simple
@@ -0,0 +1,129 @@
+"""The pending-gallery consumer against moto's in-memory S3."""
+
+import json
+
+import boto3
+import frontmatter
+import pytest
+from moto import mock_aws
+
+from content_writer import ContentEmitter
+from gallery_queue import LocalQueue
+from process_pending_galleries import PREFIX, process_pending_galleries, watch
+
+BUCKET = "i.clintecker.com"
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with mock_aws():
+        client = boto3.client("s3", region_name="us-east-1")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def put_manifest(s3, name: str, title: str = "Trip"):
+    manifest = {
+        "title": title,
+        "date": "2025-01-15T10:00:00Z",
+        "slug": name,
+        "description": f"{title} photos",
+        "tags": ["travel"],
+        "photos": [{"full": f"https://{BUCKET}/galleries/{name}/1.jpg"}],
+    }
+    s3.put_object(Bucket=BUCKET, Key=f"{PREFIX}2025-01-15-{name}.json", Body=json.dumps(manifest))
+
+
+def pending(s3) -> list:
+    listing = s3.list_objects_v2(Bucket=BUCKET, Prefix=PREFIX)
+    return [obj["Key"] for obj in listing.get("Contents", [])]
+
+
+def test_manifests_become_pages_and_are_deleted(s3, tmp_path):
+    put_manifest(s3, "beach", "Beach")
+    put_manifest(s3, "hills", "Hills")
+    s3.put_object(Bucket=BUCKET, Key=PREFIX, Body=b"")
+
+    emitter = ContentEmitter()
+    deleted = process_pending_galleries(s3=s3, bucket=BUCKET, content_dir=tmp_path, emitter=emitter)
+
+    assert sorted(deleted) == [f"{PREFIX}2025-01-15-beach.json", f"{PREFIX}2025-01-15-hills.json"]
+    page = frontmatter.load(tmp_path / "2025-01-15-beach.md")
+    assert page["title"] == "Beach" and page["type"] == "gallery"
+    assert page["photos"] == [{"full": f"https://{BUCKET}/galleries/beach/1.jpg"}]
+    assert page.content == "Beach photos"
+    # The directory marker isn't a manifest and stays put
+    assert pending(s3) == [PREFIX]
+    assert emitter.summary() == "2 files written, 0 unchanged"
+
+
+def test_every_page_of_the_listing_is_read(s3, tmp_path):
+    names = [f"g{i:02d}" for i in range(7)]
+    for name in names:
+        put_manifest(s3, name)
+
+    calls = []
+
+    def small_pages(params, **kwargs):
+        params["MaxKeys"] = 3
+        calls.append(params.get("ContinuationToken"))
+
+    s3.meta.events.register("provide-client-params.s3.ListObjectsV2", small_pages)
+
+    deleted = process_pending_galleries(s3=s3, bucket=BUCKET, content_dir=tmp_path)
+    assert len(calls) == 3 and calls[0] is None and all(calls[1:])
+    assert len(deleted) == 7
+    assert sorted(p.stem for p in tmp_path.iterdir()) == [f"2025-01-15-{n}" for n in names]
+    assert pending(s3) == []
+
+
+def test_bad_manifest_is_left_for_the_next_run(s3, tmp_path):
+    put_manifest(s3, "good")
+    s3.put_object(Bucket=BUCKET, Key=f"{PREFIX}2025-01-15-bad.json", Body=b"{not json")
+
+    deleted = process_pending_galleries(s3=s3, bucket=BUCKET, content_dir=tmp_path)
+    assert deleted == [f"{PREFIX}2025-01-15-good.json"]
+    assert pending(s3) == [f"{PREFIX}2025-01-15-bad.json"]
+    assert [p.name for p in tmp_path.iterdir()] == ["2025-01-15-good.md"]
+
+
+def test_reprocessing_an_unchanged_manifest_skips_the_write(s3, tmp_path):
+    put_manifest(s3, "beach")
+    process_pending_galleries(s3=s3, bucket=BUCKET, content_dir=tmp_path)
+    put_manifest(s3, "beach")
+
+    emitter = ContentEmitter()
+    assert process_pending_galleries(s3=s3, bucket=BUCKET, content_dir=tmp_path, emitter=emitter)
+    assert emitter.summary() == "0 files written, 1 unchanged"
+    assert pending(s3) == []
+
+
+def test_nothing_pending(s3, tmp_path):
+    assert process_pending_galleries(s3=s3, bucket=BUCKET, content_dir=tmp_path / "out") == []
+    assert not (tmp_path / "out").exists()
+
+
+def test_watch_processes_a_burst_and_acknowledges_it(s3, tmp_path):
+    put_manifest(s3, "beach")
+    put_manifest(s3, "hills")
+    notifications = LocalQueue()
+    notifications.send("beach")
+    notifications.send("hills")
+    marker = tmp_path / "rebuilt"
+
+    watch(
+        notifications,
+        rebuild_command=f"touch {marker}",
+        debounce=0,
+        max_batches=1,
+        s3=s3,
+        bucket=BUCKET,
+        content_dir=tmp_path / "galleries",
+    )
+
+    assert len(notifications.deleted) == 2
+    assert marker.exists()
+    assert len(list((tmp_path / "galleries").iterdir())) == 2
+    assert pending(s3) == []
@@ -0,0 +1,66 @@
+"""StateStore, and its one-time import of the old data/cache.json."""
+
+import json
+
+import pytest
+
+from state_store import StateStore, item_hash
+
+
+@pytest.fixture
+def cache_json(tmp_path):
+    path = tmp_path / "cache.json"
+    path.write_text(json.dumps({"posts": [1, "2"], "bookmarks": ["b1"]}))
+    return path
+
+
+def test_cache_json_is_imported_once(tmp_path, cache_json):
+    before = cache_json.read_bytes()
+    store = StateStore(tmp_path / "state.sqlite", legacy_cache_path=cache_json)
+
+    assert store.ids("posts") == {"1", "2"}
+    assert store.ids("bookmarks") == {"b1"}
+    assert store.seen("posts", 1) and store.seen("posts", "1")
+    assert store.get_meta("migrated_cache_json") == str(cache_json)
+    assert cache_json.read_bytes() == before
+    store.close()
+
+    # Ids added to cache.json later, or forgotten from the store, are not re-imported
+    cache_json.write_text(json.dumps({"posts": [1, "2", 3]}))
+    store = StateStore(tmp_path / "state.sqlite", legacy_cache_path=cache_json)
+    assert store.ids("posts") == {"1", "2"}
+
+
+def test_migration_keeps_items_already_in_the_store(tmp_path, cache_json):
+    store = StateStore(tmp_path / "state.sqlite", legacy_cache_path=None)
+    store.mark("posts", 1, "hash-1")
+    store.close()
+
+    store = StateStore(tmp_path / "state.sqlite", legacy_cache_path=cache_json)
+    assert store.count("posts") == 2
+    row = store._conn.execute(
+        "SELECT content_hash FROM items WHERE kind = 'posts' AND item_id = '1'"
+    ).fetchone()
+    assert row == ("hash-1",)
+
+
+def test_without_cache_json_nothing_is_imported(tmp_path):
+    store = StateStore(tmp_path / "state.sqlite", legacy_cache_path=tmp_path / "missing.json")
+    assert store.count("posts") == 0
+    assert store.get_meta("migrated_cache_json") is None
+
+
+def test_mark_many_and_meta(tmp_path):
+    store = StateStore(tmp_path / "state.sqlite", legacy_cache_path=None)
+    store.mark_many([("posts", 5, "a"), ("bookmarks", "b", None)])
+    store.set_meta("etag:https://example.com/feed.json", '"abc"')
+
+    store.close()
+    store = StateStore(tmp_path / "state.sqlite", legacy_cache_path=None)
+    assert store.ids("posts") == {"5"} and store.ids("bookmarks") == {"b"}
+    assert store.get_meta("etag:https://example.com/feed.json") == '"abc"'
+
+
+def test_item_hash_ignores_key_order():
+    assert item_hash({"id": 1, "title": "x"}) == item_hash({"title": "x", "id": 1})
+    assert item_hash({"id": 1, "title": "x"}) != item_hash({"id": 1, "title": "y"})
@@ -0,0 +1,239 @@
+"""Tracing and profiling shared by the build tools.
+
+Every tool accepts --trace FILE and --profile DIR (see add_arguments):
+
+  --trace    writes a Chrome trace (open in chrome://tracing or
+             https://ui.perfetto.dev) with a span per gallery, photo,
+             variant render, HTTP request and S3 call, on the thread that
+             ran it
+  --profile  runs cProfile inside stage() blocks and writes one merged
+             <tool>-<stage>.prof per stage, plus a .txt of the top
+             functions by cumulative time
+
+Only one cProfile can be active in a process, so a stage that starts while
+another is being profiled runs unprofiled (the summary says how many were
+covered). On Python 3.12+ a profile sees every thread while it runs;
+earlier versions see only the stage's own thread. Sequential modes
+(--jobs 1, --sequential) give the most complete profiles.
+
+With neither flag, span() and stage() cost one global lookup.
+"""
+
+import argparse
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+# Functions listed in each profile summary
+PROFILE_SUMMARY_LINES = 40
+
+
+class Tracer:
+    """Collects spans and per-stage profiles for one tool run."""
+
+    def __init__(self, tool: str, trace_path: Optional[Path], profile_dir: Optional[Path]):
+        self.tool = tool
+        self.trace_path = trace_path
+        self.profile_dir = profile_dir
+        self.events: List[Dict[str, Any]] = []
+        self.profiles: Dict[str, List[cProfile.Profile]] = {}
+        # stage -> [profiled, total] occurrences
+        self.profile_counts: Dict[str, List[int]] = {}
+        self.threads: Dict[int, str] = {}
+        self.origin = time.perf_counter()
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._profiler_lock = threading.Lock()
+
+    def _now_us(self) -> float:
+        return (time.perf_counter() - self.origin) * 1e6
+
+    def add_span(self, name: str, cat: str, start_us: float, end_us: float, args: Dict[str, Any]):
+        if self.trace_path is None:
+            return
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": round(start_us, 1),
+            "dur": round(end_us - start_us, 1),
+            "pid": self.pid,
+            "tid": thread.ident,
+        }
+        if args:
+            event["args"] = {key: str(value) for key, value in args.items()}
+        with self._lock:
+            self.events.append(event)
+            self.threads.setdefault(thread.ident, thread.name)
+
+    @contextmanager
+    def profiling(self, stage: str):
+        if self.profile_dir is None:
+            yield
+            return
+        profile = None
+        # Nested and concurrent stages run unprofiled, as does everything
+        # under another profiler (a debugger, coverage)
+        if self._profiler_lock.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:
+                profile = None
+                self._profiler_lock.release()
+        with self._lock:
+            counts = self.profile_counts.setdefault(stage, [0, 0])
+            counts[0] += profile is not None
+            counts[1] += 1
+        if profile is None:
+            yield
+            return
+        try:
+            yield
+        finally:
+            profile.disable()
+            self._profiler_lock.release()
+            with self._lock:
+                self.profiles.setdefault(stage, []).append(profile)
+
+    def write(self):
+        if self.trace_path is not None:
+            metadata = [
+                {"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": self.tool}}
+            ] + [
+                {"name": "thread_name", "ph": "M", "pid": self.pid, "tid": tid, "args": {"name": name}}
+                for tid, name in self.threads.items()
+            ]
+            self.trace_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.trace_path, "w") as f:
+                json.dump({"traceEvents": metadata + self.events, "displayTimeUnit": "ms"}, f)
+            print(f"Wrote trace to {self.trace_path} ({len(self.events)} spans)")
+
+        if self.profile_dir is not None and self.profiles:
+            self.profile_dir.mkdir(parents=True, exist_ok=True)
+            for stage, profiles in self.profiles.items():
+                stats = pstats.Stats(profiles[0])
+                for profile in profiles[1:]:
+                    stats.add(profile)
+                base = self.profile_dir / f"{self.tool}-{stage}"
+                stats.dump_stats(f"{base}.prof")
+
+                profiled, total = self.profile_counts[stage]
+                summary = io.StringIO()
+                summary.write(f"{stage}: {profiled} of {total} occurrences profiled\n")
+                pstats.Stats(f"{base}.prof", stream=summary).sort_stats("cumulative").print_stats(
+                    PROFILE_SUMMARY_LINES
+                )
+                Path(f"{base}.txt").write_text(summary.getvalue())
+            print(f"Wrote {len(self.profiles)} stage profiles to {self.profile_dir}")
+
+
+_tracer: Optional[Tracer] = None
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--trace", type=Path, help="Write a Chrome trace JSON file here")
+    parser.add_argument(
+        "--profile", type=Path, metavar="DIR", help="Write per-stage cProfile output to DIR"
+    )
+
+
+def configure(tool: str, trace_path: Optional[Path] = None, profile_dir: Optional[Path] = None):
+    """Start collecting for this run; output is written at exit (or by finish())."""
+    global _tracer
+    if trace_path is None and profile_dir is None:
+        return
+    _tracer = Tracer(tool, trace_path, profile_dir)
+    atexit.register(finish)
+
+
+def configure_from_args(tool: str, args: argparse.Namespace):
+    configure(tool, getattr(args, "trace", None), getattr(args, "profile", None))
+
+
+def finish():
+    """Write the trace and profiles, once."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.write()
+
+
+@contextmanager
+def span(name: str, cat: str = "", **args):
+    """Record the enclosed block as a span on the current thread."""
+    tracer = _tracer
+    if tracer is None or tracer.trace_path is None:
+        yield
+        return
+    start = tracer._now_us()
+    try:
+        yield
+    finally:
+        tracer.add_span(name, cat, start, tracer._now_us(), args)
+
+
+@contextmanager
+def stage(name: str, **args):
+    """A span that --profile also profiles, merged per stage name."""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    with span(name, "stage", **args), tracer.profiling(name):
+        yield
+
+
+def instrument_session(session):
+    """Record a span for every request a requests.Session sends.
+
+    Streamed responses are timed to their headers; time the body read with
+    its own span.
+    """
+    send = session.request
+
+    def traced_request(method, url, *args, **kwargs):
+        parsed = urlparse(url)
+        with span(f"{method} {parsed.netloc}{parsed.path}", "http"):
+            return send(method, url, *args, **kwargs)
+
+    session.request = traced_request
+    return session
+
+
+def instrument_boto3(client):
+    """Record a span for every API call a boto3 client makes (retries included)."""
+
+    def before_call(model=None, context=None, **kwargs):
+        tracer = _tracer
+        if tracer is not None and context is not None:
+            context["trace_start_us"] = tracer._now_us()
+
+    def after_call(model=None, context=None, parsed=None, **kwargs):
+        tracer = _tracer
+        if tracer is None or context is None or "trace_start_us" not in context:
+            return
+        metadata = (parsed or {}).get("ResponseMetadata") or {}
+        args = {"retries": metadata.get("RetryAttempts", 0)}
+        tracer.add_span(
+            f"{client.meta.service_model.service_name}.{getattr(model, 'name', 'call')}",
+            "aws",
+            context.pop("trace_start_us"),
+            tracer._now_us(),
+            args,
+        )
+
+    service = client.meta.service_model.endpoint_prefix
+    client.meta.events.register(f"before-call.{service}", before_call)
+    client.meta.events.register(f"after-call.{service}", after_call)
+    return client
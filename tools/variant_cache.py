@@ -0,0 +1,64 @@
+"""Content-addressed index of rendered photo variants.
+
+Maps (source SHA-256, width, format, quality) to the URL the variant was
+published at, in a small SQLite file that CI restores between runs. When a
+gallery is retried, or the same photo shows up again, process_photos.py can
+reuse the published variant instead of encoding and uploading it again.
+"""
+
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional
+
+
+class VariantCache:
+    """Thread-safe SQLite-backed variant index."""
+
+    def __init__(self, path: Path = Path("data/variant-cache.sqlite")):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS variants (
+                source_hash TEXT NOT NULL,
+                width INTEGER NOT NULL,
+                format TEXT NOT NULL,
+                quality INTEGER NOT NULL,
+                s3_key TEXT NOT NULL,
+                url TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (source_hash, width, format, quality)
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, source_hash: str, width: int, fmt: str, quality: int) -> Optional[str]:
+        """Return the published URL of a variant, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT url FROM variants"
+                " WHERE source_hash = ? AND width = ? AND format = ? AND quality = ?",
+                (source_hash, width, fmt, quality),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(
+        self, source_hash: str, width: int, fmt: str, quality: int, s3_key: str, url: str
+    ):
+        """Record a published variant (the first URL recorded for a key wins)."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO variants VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (source_hash, width, fmt, quality, s3_key, url, time.time()),
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()